@@ -1,32 +1,165 @@
+import time
+STARTUP_T0 = time.perf_counter()  # for the time-to-first-paint/listing report
+
 import tkinter as tk
 from tkinter import ttk, simpledialog, messagebox, scrolledtext, filedialog
-import paramiko
 import os
+import io
 import json
 import subprocess
 import threading
-from openai import OpenAI
+import shlex
+import itertools
+import queue
+import hashlib
+import gzip
+import stat
+import base64
+import posixpath
+import heapq
+import fnmatch
+import re
+import random
+from collections import OrderedDict, deque
 
-# Tray support
-try:
-    import pystray
-except ImportError:
-    pystray = None
+# paramiko, openai, PIL and pystray are slow to import and none of them is
+# needed to draw the window, so they are imported on first use (mostly on
+# worker threads): paramiko when a connection opens, openai on the first AI
+# request (warmed up right after startup), PIL for image previews and the
+# tray icon, pystray once the window is up.
 
+# Optional zstd support for bulky remote output (falls back to gzip)
 try:
-    from PIL import Image, ImageTk, ImageDraw
-    HAS_IMAGE_TK = True
+    import zstandard
 except ImportError:
-    from PIL import Image, ImageDraw
-    HAS_IMAGE_TK = False
-    print("Warning: PIL.ImageTk not found. Image previews will be disabled.")
-    print("To fix on Fedora: sudo dnf install python3-pillow-tk")
+    zstandard = None
+
+HAS_IMAGE_TK = True  # until load_pil finds otherwise
+_pil = None
+
+def load_pil():
+    # (Image, ImageTk or None, ImageDraw), imported once
+    global _pil, HAS_IMAGE_TK
+    if _pil is None:
+        from PIL import Image, ImageDraw
+        try:
+            from PIL import ImageTk
+        except ImportError:
+            ImageTk = None
+            HAS_IMAGE_TK = False
+            print("Warning: PIL.ImageTk not found. Image previews will be disabled.")
+            print("To fix on Fedora: sudo dnf install python3-pillow-tk")
+        _pil = (Image, ImageTk, ImageDraw)
+    return _pil
+
+def exif_thumbnail(head):
+    # The small JPEG most cameras embed in the EXIF block (APP1), if any
+    if not head.startswith(b"\xff\xd8"):
+        return None
+    pos = 2
+    while pos + 4 <= len(head) and head[pos] == 0xFF:
+        marker, length = head[pos + 1], int.from_bytes(head[pos + 2:pos + 4], "big")
+        if marker == 0xDA:
+            break  # image data starts; no more metadata segments
+        segment = head[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\0\0"):
+            soi, eoi = segment.find(b"\xff\xd8\xff"), segment.rfind(b"\xff\xd9")
+            return segment[soi:eoi + 2] if 0 <= soi < eoi else None
+        pos += 2 + length
+    return None
+
+_truncated_decode = threading.Lock()
+
+def make_thumbnail(read, size=None):
+    # PNG thumbnail of an image read through read(offset, length), touching
+    # at most IMAGE_MAX_BYTES of it: the EXIF thumbnail if there is one, else
+    # a JPEG draft-mode (DCT-scaled) decode of the start of the file. Past
+    # the cap, progressive JPEGs still come out whole at lower quality;
+    # other formats are cut off at the bottom.
+    Image = load_pil()[0]
+    head = read(0, IMAGE_HEAD_BYTES)
+    img, truncated = None, False
+    embedded = exif_thumbnail(head)
+    if embedded:
+        try:
+            img = Image.open(io.BytesIO(embedded))
+            img.load()
+        except Exception:
+            img = None
+    if img is None:
+        data = head
+        if len(head) == IMAGE_HEAD_BYTES and (size is None or size > IMAGE_HEAD_BYTES):
+            data += read(IMAGE_HEAD_BYTES, IMAGE_MAX_BYTES - IMAGE_HEAD_BYTES)
+        truncated = len(data) >= IMAGE_MAX_BYTES and (size is None or size > len(data))
+        img = Image.open(io.BytesIO(data))
+        if img.format == "JPEG":
+            img.draft("RGB", THUMB_SIZE)
+        # Only JPEGs decode scaled down; anything else would be decoded at
+        # full resolution, however little of it was read
+        width, height = img.size
+        if width * height > THUMB_MAX_PIXELS:
+            raise ValueError(f"{width}x{height} image is too large to preview without a host thumbnail tool")
+    if truncated:
+        # The capped read ends mid-image. Pillow only has a process-wide
+        # switch for that: flip it for this decode alone, one at a time
+        from PIL import ImageFile
+        with _truncated_decode:
+            previous, ImageFile.LOAD_TRUNCATED_IMAGES = ImageFile.LOAD_TRUNCATED_IMAGES, True
+            try:
+                img.load()
+            finally:
+                ImageFile.LOAD_TRUNCATED_IMAGES = previous
+    img.thumbnail(THUMB_SIZE)
+    if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        img = img.convert("RGB")  # e.g. CMYK JPEGs; PNG can't hold them
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
 
 # --- CONFIGURATION ---
 HOST = "127.0.0.1"  # Localhost (default, overridden by selected profile)
 USER = os.path.expanduser("~").split(os.sep)[-1] or "user"
 KEY_PATH = os.path.expanduser("~/.ssh/id_ed25519")  # default fallback if agent/key selection fails
 SETTINGS_FILE = os.path.expanduser("~/.neural_ssh_hosts.json")
+LOCAL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "host_functions.zsh")
+REMOTE_SCRIPT = ".host_functions.zsh"  # Hidden file in remote home
+AGENT_START_TIMEOUT = 10  # seconds to wait for the resident agent to come up
+CONNECT_TIMEOUT = 15  # seconds for the TCP connect, SSH banner and auth each
+KEEPALIVE_INTERVAL = 30  # seconds between SSH keepalives (profile key "keepalive")
+PREVIEW_BYTES = 4096  # text preview reads at most this much
+PREVIEW_LINES = 50
+PREVIEW_DEBOUNCE_MS = 120  # selection must rest this long before preview content is fetched
+IMAGE_EXTS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp']
+IDLE_TIMEOUT = 600  # close pooled hosts unused this long (profile key "idle_timeout")
+LISTING_TTL = 30  # seconds a cached listing is shown without revalidating
+LISTING_CACHE_ENTRIES = 200000  # total file entries kept across cached listings
+PREFETCH_PER_HOST = 2  # concurrent speculative requests allowed per host
+PREFETCH_MAX_DIRS = 24  # subdirectories warmed after each listing
+PREVIEW_CACHE_BYTES = 8 * 1024 * 1024  # text snippets and thumbnails held in memory
+PREVIEW_DISK_BYTES = 64 * 1024 * 1024  # on-disk preview tier under CACHE_DIR (0 = off)
+THUMB_SIZE = (300, 300)
+IMAGE_HEAD_BYTES = 64 * 1024  # first read of an image: headers and any EXIF thumbnail
+IMAGE_MAX_BYTES = 2 * 1024 * 1024  # most an image preview downloads, whatever the file size
+THUMB_MAX_PIXELS = 16 * 1024 * 1024  # largest image decoded on the client (after JPEG scaling)
+CACHE_DIR = os.path.expanduser("~/.neural_ssh_cache")  # per-host path indexes and overviews
+PATH_INDEX_MAX = 200000  # paths remembered per host; least recently seen go first
+PATH_INDEX_DIR_MAX = 20000  # bigger listings (log spools...) are not indexed
+HISTORY_MAX = 50  # visited directories remembered per host (AI context focus)
+CONTEXT_TOKEN_BUDGET = 1200  # overview tokens per AI request (profile key "context_tokens")
+AI_OUTLINE_TOKENS = 900  # top of the tree in the cacheable prompt prefix (the provider needs 1024+ tokens)
+AI_CACHE_TTL = 3600  # seconds a cached AI answer is reused
+AI_CACHE_ENTRIES = 500
+AI_CACHEABLE_ACTIONS = ("navigate", "search", "grep")  # read-only, safe to replay
+AI_MAX_CONCURRENT = 2  # AI requests in flight at once
+AI_RETRIES = 3  # retries for rate limits / transient API errors
+AI_BACKOFF = 1.0  # seconds; doubles per retry, with full jitter
+AI_BACKOFF_MAX = 20.0
+SEARCH_TIME_BUDGET = 20  # seconds before a host search is cut off
+SEARCH_MAX_RESULTS = 500
+SEARCH_HOST_TIMEOUT = 15  # per-host budget when searching several hosts
+GREP_MAX_MATCHES = 200  # content search: total matches returned
+GREP_PER_FILE = 5  # matches reported per file
+GREP_MAX_FILE_KB = 1024  # larger files are not searched
 
 def get_openai_key():
     try:
@@ -40,6 +173,2269 @@ def get_openai_key():
 
 OPENAI_KEY = get_openai_key()
 
+# --- RESIDENT HOST AGENT ---
+# Client side of the fs_agent loop in host_functions.zsh. One zsh process stays
+# resident per connection with the host functions already sourced; every call
+# is a framed request tagged with an id, so any number of threads can have
+# calls in flight over the same channel and a single round trip answers each.
+
+class AgentCallError(Exception):
+    # The call did not run to completion, so its output is partial
+    def __init__(self, call_id, rc):
+        super().__init__(f"Agent call {call_id} ended early (rc={rc})")
+        self.rc = rc
+
+
+class AgentCancelled(AgentCallError):
+    pass
+
+
+class AgentCall:
+    # Exit codes that mean the command was cut short: agent gone (-1),
+    # cancelled (130), killed (137/143). Any other rc is the command's own
+    # and stays in .rc: find/grep exit 1 on unreadable entries or no match
+    # while their output is still complete.
+    INCOMPLETE = (-1, 130, 137, 143)
+
+    def __init__(self, agent, call_id):
+        self.agent = agent
+        self.id = call_id
+        self.chunks = queue.Queue()
+        self.done = threading.Event()
+        self.rc = None
+
+    def _feed(self, data):
+        self.chunks.put(data)
+
+    def _finish(self, rc):
+        self.rc = rc
+        self.done.set()
+        self.chunks.put(None)
+
+    def iter_chunks(self, timeout=None):
+        # Yields raw stdout chunks as they arrive until the command finishes
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"Agent call {self.id} timed out")
+            if chunk is None:
+                if self.rc == 130:
+                    raise AgentCancelled(self.id, self.rc)
+                if self.rc in self.INCOMPLETE:
+                    raise AgentCallError(self.id, self.rc)
+                return
+            yield chunk
+
+    def read(self, timeout=None):
+        return b"".join(self.iter_chunks(timeout))
+
+    def text(self, timeout=None):
+        return self.read(timeout).decode(errors="replace").strip()
+
+    def cancel(self):
+        self.agent.cancel(self)
+
+
+class HostAgent:
+    def __init__(self, reader, write, close):
+        self._reader = reader
+        self._write = write
+        self._close = close
+        self._write_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._ready = threading.Event()
+        self.alive = True
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        if not self._ready.wait(AGENT_START_TIMEOUT) or not self.alive:
+            self.close()
+            raise RuntimeError("host agent did not start")
+
+    @classmethod
+    def over_ssh(cls, ssh):
+        chan = ssh.get_transport().open_session()
+        chan.exec_command(f"zsh -c 'source ~/{REMOTE_SCRIPT} && fs_agent'")
+        return cls(chan.makefile("rb"), chan.sendall, chan.close)
+
+    @classmethod
+    def local(cls, script_path=LOCAL_SCRIPT):
+        proc = subprocess.Popen(
+            ["zsh", "-c", f"source {shlex.quote(script_path)} && fs_agent"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def write(data):
+            proc.stdin.write(data)
+            proc.stdin.flush()
+
+        def close():
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            proc.terminate()
+
+        return cls(proc.stdout, write, close)
+
+    def _read_loop(self):
+        try:
+            while True:
+                header = self._reader.readline()
+                if not header:
+                    break
+                call_id, kind, arg = header.decode().split()
+                if kind == "D":
+                    data = self._reader.read(int(arg))
+                    call = self._pending.get(call_id)
+                    if call:
+                        call._feed(data)
+                elif kind == "E":
+                    if call_id == "0":
+                        self._ready.set()
+                        continue
+                    call = self._pending.pop(call_id, None)
+                    if call:
+                        call._finish(int(arg))
+        except Exception:
+            pass
+        finally:
+            self.alive = False
+            self._ready.set()
+            # Unblock everyone still waiting on this agent
+            for call in list(self._pending.values()):
+                call._finish(-1)
+            self._pending.clear()
+
+    def _send(self, data):
+        with self._write_lock:
+            self._write(data)
+
+    def submit(self, cmd):
+        if not self.alive:
+            raise ConnectionError("host agent is not running")
+        call = AgentCall(self, str(next(self._ids)))
+        self._pending[call.id] = call
+        payload = cmd.encode("utf-8", "surrogateescape")
+        self._send(f"R {call.id} {len(payload)}\n".encode() + payload)
+        # Cancelling the task that issued this call kills it on the host too
+        task = current_task()
+        if task:
+            task.on_cancel(call.cancel)
+        return call
+
+    def call(self, cmd, timeout=None):
+        return self.submit(cmd).text(timeout)
+
+    def cancel(self, call):
+        if call.done.is_set() or not self.alive:
+            return
+        try:
+            self._send(f"C {call.id}\n".encode())
+        except Exception:
+            pass
+
+    def close(self):
+        self.alive = False
+        try:
+            self._send(b"Q\n")
+        except Exception:
+            pass
+        try:
+            self._close()
+        except Exception:
+            pass
+
+
+# --- TASK ENGINE ---
+# Remote I/O never runs on the Tk thread. Work is submitted as a Task to a
+# small worker pool; results are queued and applied from the Tk loop via
+# after() at ~60 fps. Submitting with a key cancels the previous task with the
+# same key (e.g. the listing of a directory the user already left), and
+# cancelling a task also cancels any agent call it has in flight.
+
+_task_local = threading.local()
+
+def current_task():
+    return getattr(_task_local, "task", None)
+
+
+class Task:
+    def __init__(self, fn, on_done=None, on_error=None, key=None, on_progress=None):
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.key = key
+        self._sink = None  # set by the engine
+        self._cancelled = threading.Event()
+        self._cancel_hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def progress(self, value):
+        # Hand a partial result to on_progress on the Tk thread
+        if self.on_progress and self._sink and not self.cancelled:
+            self._sink((self, lambda: self.on_progress(value)))
+
+    def on_cancel(self, hook):
+        # Register cleanup to run if the task is cancelled (runs now if it was)
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_hooks.append(hook)
+                return
+        hook()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._cancelled.set()
+        self.interrupt()
+
+    def interrupt(self):
+        # Stop the host calls in flight (run the cancel hooks) but leave the
+        # task alive, so it can still report what it found
+        with self._lock:
+            hooks, self._cancel_hooks = self._cancel_hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def interrupt_after(self, seconds):
+        # Time budget that holds even while a host call produces no output;
+        # cancel() the returned timer when the work finishes first
+        timer = threading.Timer(max(0.0, seconds), self.interrupt)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class TaskEngine:
+    def __init__(self, root, workers=4, poll_ms=16):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._keyed = {}
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, fn, on_done=None, on_error=None, key=None, on_progress=None):
+        # fn(task) runs on a worker; on_done(result) / on_error(exc) and
+        # on_progress(partial) for each task.progress() call run on Tk
+        task = Task(fn, on_done, on_error, key, on_progress)
+        task._sink = self._results.put
+        if key:
+            with self._lock:
+                prev = self._keyed.get(key)
+                self._keyed[key] = task
+            if prev:
+                prev.cancel()
+        self._jobs.put(task)
+        return task
+
+    def cancel(self, key):
+        with self._lock:
+            task = self._keyed.pop(key, None)
+        if task:
+            task.cancel()
+
+    def call_soon(self, fn, *args):
+        # Run fn on the Tk thread (safe to call from any thread)
+        self._results.put((None, lambda: fn(*args)))
+
+    def _worker(self):
+        while True:
+            task = self._jobs.get()
+            if task.cancelled:
+                continue
+            _task_local.task = task
+            try:
+                result = task.fn(task)
+                if task.on_done:
+                    self._results.put((task, lambda t=task, r=result: t.on_done(r)))
+            except Exception as e:
+                if task.on_error:
+                    self._results.put((task, lambda t=task, err=e: t.on_error(err)))
+                else:
+                    print(f"Task failed: {e}")
+            finally:
+                _task_local.task = None
+                if task.key:
+                    with self._lock:
+                        if self._keyed.get(task.key) is task:
+                            del self._keyed[task.key]
+
+    def _drain(self):
+        try:
+            while True:
+                task, callback = self._results.get_nowait()
+                if task is not None and task.cancelled:
+                    continue  # Superseded while we were waiting for it
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Task callback failed: {e}")
+        except queue.Empty:
+            pass
+        try:
+            self.root.after(self.poll_ms, self._drain)
+        except tk.TclError:
+            pass  # Window destroyed
+
+
+# --- AI SCHEDULER ---
+# AI commands are queued here instead of each getting a raw thread. At most
+# AI_MAX_CONCURRENT run at once; a new command supersedes any still waiting
+# to start; rate limits and transient errors are retried with jittered
+# backoff; and results are applied strictly in submission order, so a slow
+# earlier reply can't navigate away from where a later one went.
+
+def retry_delay(exc, attempt):
+    # Seconds to wait before retrying exc, or None if it isn't transient
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        transient = isinstance(exc, (ConnectionError, TimeoutError)) or \
+            type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+    else:
+        transient = status in (408, 409, 429) or status >= 500
+    if not transient:
+        return None
+    response = getattr(exc, "response", None)
+    try:
+        hinted = float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        hinted = 0.0
+    return max(hinted, random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF * 2 ** attempt)))
+
+
+class AIScheduler:
+    def __init__(self, call_soon, max_concurrent=AI_MAX_CONCURRENT, retries=AI_RETRIES,
+                 on_retry=None, on_idle=None):
+        self.call_soon = call_soon
+        self.max_concurrent = max_concurrent
+        self.retries = retries
+        self.on_retry = on_retry  # on_retry(task, attempt, delay, exc), Tk thread
+        self.on_idle = on_idle  # nothing left to apply, Tk thread
+        self._waiting = deque()  # not started yet
+        self._order = deque()  # not applied yet, in submission order
+        self._outcome = {}
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, on_done=None, on_error=None):
+        # fn(task) runs on a worker thread; returns (task, superseded tasks)
+        task = Task(fn, on_done, on_error)
+        with self._lock:
+            superseded = list(self._waiting)
+            self._waiting.clear()
+            for old in superseded:
+                old.cancel()
+            self._waiting.append(task)
+            self._order.append(task)
+            self._start_more()
+        return task, superseded
+
+    def cancel_all(self):
+        with self._lock:
+            pending = list(self._order)
+            self._waiting.clear()
+        for task in pending:
+            task.cancel()
+        self.call_soon(self._apply)
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for t in self._order if not t.cancelled)
+
+    def is_next(self, task):
+        # True once every earlier request has been applied or cancelled
+        # (Tk thread); lets a streaming reply act before it has finished
+        self._apply()
+        with self._lock:
+            for t in self._order:
+                if t is task:
+                    return True
+                if not t.cancelled:
+                    return False
+        return False
+
+    def _start_more(self):
+        # Call with the lock held
+        while self._waiting and self._running < self.max_concurrent:
+            task = self._waiting.popleft()
+            self._running += 1
+            threading.Thread(target=self._run, args=(task,), daemon=True).start()
+
+    def _run(self, task):
+        attempt = 0
+        while True:
+            try:
+                outcome = (True, task.fn(task))
+            except Exception as e:
+                delay = retry_delay(e, attempt) if attempt < self.retries else None
+                if delay is not None and not task.cancelled:
+                    attempt += 1
+                    if self.on_retry:
+                        self.call_soon(self.on_retry, task, attempt, delay, e)
+                    if not task._cancelled.wait(delay):
+                        continue
+                outcome = (False, e)
+            break
+        with self._lock:
+            if not task.cancelled:
+                self._outcome[task] = outcome
+            self._running -= 1
+            self._start_more()
+        self.call_soon(self._apply)
+
+    def _apply(self):
+        # Tk thread: hand finished results over in submission order
+        while True:
+            with self._lock:
+                if not self._order:
+                    break
+                task = self._order[0]
+                if not task.cancelled and task not in self._outcome:
+                    return  # the oldest request is still running
+                self._order.popleft()
+                ok, value = self._outcome.pop(task, (True, None))
+            if task.cancelled:
+                continue
+            callback = task.on_done if ok else task.on_error
+            try:
+                if callback:
+                    callback(value)
+            except Exception as e:
+                print(f"AI callback failed: {e}")
+        if self.on_idle:
+            self.on_idle()
+
+
+# --- HOST CAPABILITIES ---
+# fs_caps reports which tools the host has; for each operation the first
+# host function whose requirement is met wins, so GNU hosts get the fast
+# paths and minimal hosts still work.
+HOST_IMPLS = {
+    "list": [("fs_list", "gnu_find"), ("fs_list_portable", None)],
+    # fs_index_search answers from the host's path index, falling back to
+    # fs_search itself while the index is missing or doesn't cover the path
+    "search": [("fs_index_search", "gnu_find"), ("fs_search_portable", None)],
+    "grep": [("fs_grep_rg", "rg"), ("fs_grep", None)],
+    # No fallback: without a host tool the client thumbnails a capped read
+    "thumb": [("fs_thumb_vips", "vipsthumbnail"), ("fs_thumb_magick", "imagemagick"), (None, None)],
+}
+
+def parse_caps(text):
+    caps = {}
+    for line in text.splitlines():
+        key, _, val = line.partition("=")
+        if key.strip():
+            caps[key.strip()] = val.strip() == "1"
+    return caps
+
+def pick_impls(caps):
+    return {op: next(fn for fn, need in impls if need is None or caps.get(need))
+            for op, impls in HOST_IMPLS.items()}
+
+def script_digest(path=LOCAL_SCRIPT):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# --- FILESYSTEM BACKENDS ---
+# One interface (list, stat, search, read_range, write) with an
+# implementation per transport, picked per host by the profile's "backend"
+# key ("auto", "sftp" or "shell"). Remote hosts default to SFTP, which needs
+# no shell fork per listing; local mode uses os.scandir, no subprocess at all.
+
+class FileEntry:
+    # type uses find's %y letters: d, f, l, p, s, c, b
+    __slots__ = ("type", "name", "size", "mtime", "mode", "target")
+
+    def __init__(self, ftype, name, size=None, mtime=None, mode=None, target=None):
+        self.type = ftype
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.target = target
+
+    @property
+    def is_dir(self):
+        return self.type == "d"
+
+    @property
+    def is_file(self):
+        # Regular files only: opening a FIFO or device for a preview blocks
+        return self.type == "f"
+
+    def sort_key(self):
+        return (self.type, self.name)
+
+    def __repr__(self):
+        return f"FileEntry({self.type!r}, {self.name!r}, {self.size!r})"
+
+
+def mode_type(mode):
+    if stat.S_ISDIR(mode): return "d"
+    if stat.S_ISLNK(mode): return "l"
+    if stat.S_ISREG(mode): return "f"
+    if stat.S_ISFIFO(mode): return "p"
+    if stat.S_ISSOCK(mode): return "s"
+    if stat.S_ISCHR(mode): return "c"
+    if stat.S_ISBLK(mode): return "b"
+    return "f"
+
+
+def decode_name(raw):
+    # Names are bytes on the host; surrogateescape keeps non-UTF-8 names
+    # round-trippable when we send them back in a command
+    return raw.decode("utf-8", "surrogateescape")
+
+
+_TYPES = {t.encode(): t for t in "dflpscb"}
+
+def _record_entry(fields):
+    ftype, name, size, mtime, mode, target = fields
+    try:
+        mtime = float(mtime)
+    except ValueError:
+        mtime = None
+    return FileEntry(_TYPES.get(ftype) or ftype.decode(), decode_name(name),
+                     int(size) if size.isdigit() else None, mtime,
+                     int(mode, 8) if mode else None,
+                     decode_name(target) if target else None)
+
+
+class ListingParser:
+    # Incremental parser for the NUL-delimited listing records emitted by
+    # fs_list / fs_search / fs_stat (six fields each, see host_functions.zsh).
+    # Feed it raw chunks as they arrive; it returns complete entries.
+    FIELDS = 6
+
+    def __init__(self):
+        self._tail = b""
+        self._fields = []
+
+    def feed(self, chunk):
+        parts = (self._tail + chunk).split(b"\0")
+        self._tail = parts.pop()
+        fields = self._fields
+        fields.extend(parts)
+        n = len(fields) - len(fields) % self.FIELDS
+        entries = [_record_entry(fields[i:i + self.FIELDS]) for i in range(0, n, self.FIELDS)]
+        del fields[:n]
+        return entries
+
+
+def parse_listing(raw):
+    return ListingParser().feed(raw)
+
+
+class GrepParser:
+    # Incremental parser for fs_grep output: one "path\0line:text" per line.
+    # Returns complete (path, line_number, text) matches.
+    def __init__(self):
+        self._tail = b""
+
+    def feed(self, chunk):
+        lines = (self._tail + chunk).split(b"\n")
+        self._tail = lines.pop()
+        matches = []
+        for line in lines:
+            path, sep, rest = line.partition(b"\0")
+            num, _, text = rest.partition(b":")
+            if sep and num.isdigit():
+                matches.append((decode_name(path), int(num), text.decode(errors="replace")))
+        return matches
+
+
+class FsBackend:
+    name = "base"
+
+    def list(self, path):
+        raise NotImplementedError
+
+    def list_dir(self, path):
+        # Listing plus the directory's own mtime, for cache revalidation.
+        # Stat first so a change during the listing is caught next time.
+        try:
+            mtime = self.stat(path).mtime
+        except Exception:
+            mtime = None
+        return self.list(path), mtime
+
+    def iter_list_dir(self, path):
+        # Streaming variant: yields (batch_of_entries, dir_mtime) as data
+        # arrives; entries are unsorted, dir_mtime may be None until known
+        entries, mtime = self.list_dir(path)
+        yield entries, mtime
+
+    def stat(self, path):
+        raise NotImplementedError
+
+    def search(self, term, base, limit=50):
+        # Returns FileEntry objects whose name is the full path
+        raise NotImplementedError
+
+    def iter_search(self, term, base, limit=50):
+        # Streaming variant: yields batches of hits as they are found
+        yield self.search(term, base, limit)
+
+    def iter_grep(self, pattern, base, limit=GREP_MAX_MATCHES, regex=False):
+        # Content search: yields batches of (path, line_number, text),
+        # binary and oversized files skipped, at most GREP_PER_FILE per file
+        raise NotImplementedError
+
+    def read_range(self, path, offset=0, length=None):
+        raise NotImplementedError
+
+    def thumbnail(self, path, size):
+        # Encoded image no larger than size x size made on the host, or None
+        # when the host has no tool for it
+        return None
+
+    def write(self, path, data):
+        raise NotImplementedError
+
+
+class ShellBackend(FsBackend):
+    # Everything goes through the host functions (resident agent when up)
+    name = "shell"
+
+    def __init__(self, run, host_fn, run_raw, stream):
+        self.run = run
+        self.host_fn = host_fn
+        self.run_raw = run_raw
+        self.stream = stream
+
+    def list(self, path):
+        entries = parse_listing(self.run_raw(f"{self.host_fn('list')} {shlex.quote(path)}"))
+        entries.sort(key=FileEntry.sort_key)
+        return entries
+
+    def list_dir(self, path):
+        # Stat and list in a single round trip
+        q = shlex.quote(path)
+        entries = parse_listing(self.run_raw(f"fs_stat {q}; {self.host_fn('list')} {q}"))
+        if entries and entries[0].name == path:
+            mtime = entries.pop(0).mtime
+        else:
+            mtime = None
+        entries.sort(key=FileEntry.sort_key)
+        return entries, mtime
+
+    def iter_list_dir(self, path):
+        # Parse complete records as chunks come off the channel
+        q = shlex.quote(path)
+        parser = ListingParser()
+        dir_mtime, first = None, True
+        for chunk in self.stream(f"fs_stat {q}; {self.host_fn('list')} {q}"):
+            entries = parser.feed(chunk)
+            if first and entries:
+                first = False
+                if entries[0].name == path:
+                    dir_mtime = entries.pop(0).mtime
+            yield entries, dir_mtime
+
+    def stat(self, path):
+        entries = parse_listing(self.run_raw(f"fs_stat {shlex.quote(path)}"))
+        if not entries:
+            raise FileNotFoundError(path)
+        return entries[0]
+
+    def _search_cmd(self, term, base, limit):
+        return f"{self.host_fn('search')} {shlex.quote(term)} {shlex.quote(base)} {int(limit)}"
+
+    def search(self, term, base, limit=50):
+        return parse_listing(self.run_raw(self._search_cmd(term, base, limit)))[:limit]
+
+    def iter_search(self, term, base, limit=50):
+        parser = ListingParser()
+        for chunk in self.stream(self._search_cmd(term, base, limit)):
+            yield parser.feed(chunk)
+
+    def iter_grep(self, pattern, base, limit=GREP_MAX_MATCHES, regex=False):
+        cmd = (f"{self.host_fn('grep')} {shlex.quote(pattern)} {shlex.quote(base)} "
+               f"{int(limit)} {GREP_PER_FILE} {GREP_MAX_FILE_KB} {int(bool(regex))}")
+        parser = GrepParser()
+        for chunk in self.stream(cmd):
+            yield parser.feed(chunk)
+
+    def read_range(self, path, offset=0, length=None):
+        cmd = f"tail -c +{offset + 1} {shlex.quote(path)}"
+        if length is not None:
+            cmd += f" | head -c {int(length)}"
+        return self.run_raw(cmd)
+
+    def thumbnail(self, path, size):
+        fn = self.host_fn("thumb")
+        if not fn:
+            return None
+        return self.run_raw(f"{fn} {shlex.quote(path)} {int(size)}") or None
+
+    def write(self, path, data):
+        payload = base64.b64encode(data).decode()
+        self.run(f"print -rn -- {payload} | base64 -d > {shlex.quote(path)}")
+
+
+class SftpBackend(FsBackend):
+    # Native SFTP requests, no shell on the host. Search has no SFTP
+    # equivalent worth doing client side, so it goes to the shell backend.
+    name = "sftp"
+
+    def __init__(self, open_sftp, shell):
+        # open_sftp() -> live SFTPClient, reconnecting first if the link
+        # dropped (HostConnection.live_sftp)
+        self.open_sftp = open_sftp
+        self.shell = shell
+
+    @property
+    def sftp(self):
+        return self.open_sftp()
+
+    @staticmethod
+    def _entry(name, attr):
+        mode = attr.st_mode or 0
+        return FileEntry(mode_type(mode), name, attr.st_size, attr.st_mtime, stat.S_IMODE(mode))
+
+    def list(self, path):
+        entries = [self._entry(a.filename, a) for a in self.sftp.listdir_attr(path)]
+        entries.sort(key=FileEntry.sort_key)
+        return entries
+
+    def iter_list_dir(self, path, batch_size=500):
+        # listdir_iter pipelines READDIR requests and yields as replies land
+        sftp = self.sftp
+        try:
+            mtime = sftp.stat(path).st_mtime
+        except IOError:
+            mtime = None
+        batch = []
+        for attr in sftp.listdir_iter(path):
+            batch.append(self._entry(attr.filename, attr))
+            if len(batch) >= batch_size:
+                yield batch, mtime
+                batch = []
+        yield batch, mtime
+
+    def stat(self, path):
+        return self._entry(path, self.sftp.lstat(path))
+
+    def search(self, term, base, limit=50):
+        return self.shell.search(term, base, limit)
+
+    def iter_search(self, term, base, limit=50):
+        return self.shell.iter_search(term, base, limit)
+
+    def iter_grep(self, pattern, base, limit=GREP_MAX_MATCHES, regex=False):
+        return self.shell.iter_grep(pattern, base, limit, regex)
+
+    def read_range(self, path, offset=0, length=None):
+        with self.sftp.open(path, "rb") as f:
+            if offset:
+                f.seek(offset)
+            return f.read(length) if length is not None else f.read()
+
+    def thumbnail(self, path, size):
+        return self.shell.thumbnail(path, size)
+
+    def write(self, path, data):
+        with self.sftp.open(path, "wb") as f:
+            f.write(data)
+
+
+class LocalBackend(FsBackend):
+    name = "local"
+
+    @staticmethod
+    def _entry(name, path, st):
+        ftype = mode_type(st.st_mode)
+        target = None
+        if ftype == "l":
+            try:
+                target = os.readlink(path)
+            except OSError:
+                pass
+        return FileEntry(ftype, name, st.st_size, st.st_mtime, stat.S_IMODE(st.st_mode), target)
+
+    def list(self, path):
+        entries = []
+        with os.scandir(path) as it:
+            for de in it:
+                try:
+                    entries.append(self._entry(de.name, de.path, de.stat(follow_symlinks=False)))
+                except OSError:
+                    continue
+        entries.sort(key=FileEntry.sort_key)
+        return entries
+
+    def iter_list_dir(self, path, batch_size=1000):
+        mtime = os.stat(path).st_mtime
+        batch = []
+        with os.scandir(path) as it:
+            for de in it:
+                try:
+                    batch.append(self._entry(de.name, de.path, de.stat(follow_symlinks=False)))
+                except OSError:
+                    continue
+                if len(batch) >= batch_size:
+                    yield batch, mtime
+                    batch = []
+        yield batch, mtime
+
+    def stat(self, path):
+        return self._entry(path, path, os.lstat(path))
+
+    def search(self, term, base, limit=50, max_depth=6):
+        return list(itertools.chain.from_iterable(self.iter_search(term, base, limit, max_depth)))
+
+    def iter_search(self, term, base, limit=50, max_depth=6):
+        # Same semantics as fs_search: case-insensitive name match, depth 6;
+        # one batch per directory, empty when it had no hits, so the caller
+        # gets control back to honour Cancel and its time budget
+        term = term.lower()
+        found = 0
+        stack = [(base, 1)]
+        while stack and found < limit:
+            path, depth = stack.pop()
+            batch = []
+            try:
+                with os.scandir(path) as it:
+                    for de in it:
+                        if term in de.name.lower():
+                            try:
+                                batch.append(self._entry(de.path, de.path, de.stat(follow_symlinks=False)))
+                            except OSError:
+                                continue
+                            if found + len(batch) >= limit:
+                                break
+                        if depth < max_depth and de.is_dir(follow_symlinks=False):
+                            stack.append((de.path, depth + 1))
+            except OSError:
+                continue
+            found += len(batch)
+            yield batch
+
+    def iter_grep(self, pattern, base, limit=GREP_MAX_MATCHES, regex=False):
+        # Same rules as fs_grep: smart case, binary (NUL in the first 8 KB)
+        # and oversized files skipped. One batch per file, empty when it had
+        # no matches, so the caller can stop between files (Cancel, budget)
+        flags = re.IGNORECASE if pattern == pattern.lower() else 0
+        rx = re.compile(pattern if regex else re.escape(pattern), flags)
+        found = 0
+        for root, dirs, files in os.walk(base):
+            dirs[:] = [d for d in dirs if d != ".git"]
+            for name in files:
+                path = os.path.join(root, name)
+                data = None
+                try:
+                    st = os.stat(path)
+                    # Regular files only: opening a FIFO would block the walk
+                    if stat.S_ISREG(st.st_mode) and st.st_size <= GREP_MAX_FILE_KB * 1024:
+                        with open(path, "rb") as f:
+                            data = f.read()
+                except OSError:
+                    pass
+                if data is None or b"\0" in data[:8192]:
+                    yield []
+                    continue
+                batch = []
+                for num, line in enumerate(data.decode(errors="replace").splitlines(), 1):
+                    if rx.search(line):
+                        batch.append((path, num, line[:400]))
+                        if len(batch) >= GREP_PER_FILE or found + len(batch) >= limit:
+                            break
+                found += len(batch)
+                yield batch
+                if found >= limit:
+                    return
+
+    def read_range(self, path, offset=0, length=None):
+        with open(path, "rb") as f:
+            if offset:
+                f.seek(offset)
+            return f.read(length) if length is not None else f.read()
+
+    def write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+# --- CACHES ---
+
+class LRUCache:
+    # Thread-safe LRU bounded by total weight (default: one per item)
+    def __init__(self, max_weight, weigh=None):
+        self.max_weight = max_weight
+        self.weigh = weigh or (lambda value: 1)
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        w = self.weigh(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old:
+                self.weight -= old[1]
+            if w > self.max_weight:
+                return
+            self._items[key] = (value, w)
+            self.weight += w
+            while self.weight > self.max_weight:
+                _, (_, ew) = self._items.popitem(last=False)
+                self.weight -= ew
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item:
+                self.weight -= item[1]
+                return item[0]
+            return None
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._items if predicate(k)]:
+                self.weight -= self._items.pop(key)[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def items(self):
+        # (key, value) pairs, least recently used first
+        with self._lock:
+            return [(k, v) for k, (v, _) in self._items.items()]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CachedListing:
+    __slots__ = ("entries", "dir_mtime", "fetched_at")
+
+    def __init__(self, entries, dir_mtime):
+        self.entries = entries
+        self.dir_mtime = dir_mtime
+        self.fetched_at = time.time()
+
+
+class ListingCache:
+    # Directory listings keyed by (host, path). Within the TTL a listing is
+    # used as-is; after that it is still shown immediately but revalidated
+    # against the directory's mtime (and re-listed only if it changed).
+    def __init__(self, ttl=LISTING_TTL, max_entries=LISTING_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.homes = {}  # host -> $HOME, so ".", "~/x" and /home/u/x share one key
+        self._lru = LRUCache(max_entries, weigh=lambda c: len(c.entries) + 1)
+
+    def _key(self, host, path):
+        home = self.homes.get(host)
+        return (host, resolve_path(path, home) if home else posixpath.normpath(path))
+
+    def get(self, host, path):
+        return self._lru.get(self._key(host, path))
+
+    def put(self, host, path, entries, dir_mtime=None):
+        cached = CachedListing(entries, dir_mtime)
+        self._lru.put(self._key(host, path), cached)
+        return cached
+
+    def is_fresh(self, cached):
+        return time.time() - cached.fetched_at < self.ttl
+
+    def touch(self, cached):
+        cached.fetched_at = time.time()
+
+    def invalidate(self, host, path=None):
+        # Drop one directory's listing, or everything cached for the host
+        if path is None:
+            self._lru.discard_where(lambda k: k[0] == host)
+        else:
+            self._lru.pop(self._key(host, path))
+
+
+class PreviewCache:
+    # Rendered previews (text snippets, PNG thumbnails) keyed by
+    # (host, path, size, mtime) plus kind, so a changed file never hits a
+    # stale entry. A byte-bounded LRU in memory, backed by an optional
+    # directory of files that survives restarts; entries for paths a newer
+    # listing shows as changed or gone are dropped by sync_dir.
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES, disk_dir=None, disk_bytes=PREVIEW_DISK_BYTES):
+        self._mem = LRUCache(max_bytes, weigh=len)
+        self.disk_dir = disk_dir if disk_bytes else None
+        self.disk_bytes = disk_bytes
+        self._disk_used = None  # measured on first write
+        self._disk_lock = threading.Lock()
+
+    @staticmethod
+    def _stem(host, path):
+        return hashlib.sha1(f"{host}\0{path}".encode("utf-8", "surrogateescape")).hexdigest()[:20]
+
+    def _file(self, key, kind):
+        host, path, size, mtime = key
+        return os.path.join(self.disk_dir, f"{self._stem(host, path)}_{size}_{mtime}.{kind}")
+
+    def get(self, key, kind):
+        data = self._mem.get(key + (kind,))
+        if data is not None or not self.disk_dir:
+            return data
+        try:
+            with open(self._file(key, kind), "rb") as f:
+                data = f.read()
+            os.utime(self._file(key, kind))  # disk tier evicts least recently used
+        except OSError:
+            return None
+        self._mem.put(key + (kind,), data)
+        return data
+
+    def contains(self, key, kind):
+        return key + (kind,) in self._mem or bool(self.disk_dir and os.path.exists(self._file(key, kind)))
+
+    def put(self, key, kind, data):
+        self._mem.put(key + (kind,), data)
+        if not self.disk_dir or None in key[2:]:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(self._file(key, kind), "wb") as f:
+                f.write(data)
+        except OSError:
+            return
+        with self._disk_lock:
+            if self._disk_used is None:
+                self._disk_used = sum(e.stat().st_size for e in os.scandir(self.disk_dir))
+            else:
+                self._disk_used += len(data)
+            if self._disk_used > self.disk_bytes:
+                self._trim_disk()
+
+    def _trim_disk(self):
+        # Oldest files first, down to 3/4 of the budget (call with the lock held)
+        files = sorted(os.scandir(self.disk_dir), key=lambda e: e.stat().st_mtime)
+        for e in files:
+            if self._disk_used <= self.disk_bytes * 3 // 4:
+                break
+            try:
+                size = e.stat().st_size
+                os.remove(e.path)
+                self._disk_used -= size
+            except OSError:
+                pass
+
+    def sync_dir(self, host, directory, entries):
+        # A fresh listing of directory: forget previews of its files whose
+        # size/mtime no longer match or that are gone (on disk only changed
+        # files can be found; the others just age out)
+        current = {os.path.join(directory, e.name): (e.size, e.mtime) for e in entries}
+        self._mem.discard_where(lambda k: k[0] == host and os.path.dirname(k[1]) == directory
+                                and current.get(k[1]) != (k[2], k[3]))
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        wanted = {self._stem(host, p): f"_{size}_{mtime}." for p, (size, mtime) in current.items()}
+        for e in os.scandir(self.disk_dir):
+            stem, _, rest = e.name.partition("_")
+            if stem in wanted and not ("_" + rest).startswith(wanted[stem]):
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+                with self._disk_lock:
+                    self._disk_used = None
+
+
+class ResponseCache:
+    # Parsed AI actions keyed by (host, normalized command, hash of the
+    # context that matters for it), reused for AI_CACHE_TTL seconds, so a
+    # repeated "go to Downloads" never reaches the API.
+    def __init__(self, file=None, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_ENTRIES):
+        self.file = file
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lru = LRUCache(max_entries)
+
+    @staticmethod
+    def key(host, command, context):
+        norm = " ".join(re.sub(r"[^\w\s./~-]", " ", command.lower()).split())
+        digest = hashlib.sha1(context.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return f"{host}\0{norm}\0{digest}"
+
+    def get(self, key):
+        item = self._lru.get(key)
+        if item and time.time() - item[0] < self.ttl:
+            self.hits += 1
+            return item[1]
+        if item:
+            self._lru.pop(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, action):
+        self._lru.put(key, (time.time(), action))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"AI cache: {self.hits}/{total} hits ({100 * self.hits / total:.0f}%)" if total else "AI cache: no requests yet"
+
+    def load(self):
+        try:
+            with open(self.file, encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError, TypeError):
+            return
+        now = time.time()
+        for key, stamp, action in items:
+            if now - stamp < self.ttl:
+                self._lru.put(key, (stamp, action))
+
+    def save(self):
+        if not self.file:
+            return
+        items = [[k, stamp, action] for k, (stamp, action) in self._lru.items()]
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        os.replace(self.file + ".tmp", self.file)
+
+
+# --- PATH INDEX ---
+# Every path the client has seen on a host (overview, listings, search
+# results) with a trigram index over lowercased basenames, so filename
+# queries are answered and ranked locally. Persisted per host between runs.
+
+def resolve_path(path, home):
+    # Absolute, normalized form of a host path (relative means under home)
+    if path == "~" or path.startswith("~/"):
+        path = home + path[1:]
+    elif not path.startswith("/"):
+        path = posixpath.join(home, path)
+    return posixpath.normpath(path)
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def name_score(term, name):
+    # How well a basename matches a query: exact > prefix > substring > glob
+    term, name = term.lower(), name.lower()
+    if any(c in term for c in "*?["):
+        return 2.0 if fnmatch.fnmatchcase(name, term) else 0.0
+    if name == term:
+        return 3.0
+    if name.startswith(term):
+        return 2.0
+    if term in name:
+        return 1.0
+    return 0.0
+
+def search_rank(term, entry, now=None):
+    # Order for search hits (higher first): name match, then recently
+    # modified (decaying over about a week), then shallow paths
+    score = name_score(term, posixpath.basename(entry.name.rstrip("/")))
+    if entry.mtime:
+        age = max(0.0, (now or time.time()) - entry.mtime)
+        score += 0.5 / (1 + age / (7 * 86400))
+    return score - min(entry.name.count("/"), 20) * 0.02
+
+
+class PathIndex:
+    def __init__(self, file=None, max_paths=PATH_INDEX_MAX):
+        self.file = file
+        self.max_paths = max_paths
+        self.paths = []       # id -> path, None once removed
+        self.types = []       # id -> entry type
+        self.ids = OrderedDict()  # path -> id, least recently seen first
+        self.children = {}    # directory -> ids of its known entries
+        self.postings = {}    # trigram -> ids (may hold removed ids)
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _add(self, path, ftype):
+        pid = self.ids.get(path)
+        if pid is not None:
+            self.types[pid] = ftype
+            self.ids.move_to_end(path)
+            return
+        if len(self.ids) >= self.max_paths:
+            # Full: forget the least recently seen path (only that one; its
+            # children, if any, were seen on their own)
+            old, old_id = self.ids.popitem(last=False)
+            self.paths[old_id] = None
+            self.children.get(posixpath.dirname(old), set()).discard(old_id)
+        pid = len(self.paths)
+        self.paths.append(path)
+        self.types.append(ftype)
+        self.ids[path] = pid
+        self.children.setdefault(posixpath.dirname(path), set()).add(pid)
+        name = posixpath.basename(path).lower()
+        for gram in trigrams(name) or {name}:
+            self.postings.setdefault(gram, []).append(pid)
+        self.dirty = True
+
+    def _remove(self, path):
+        pid = self.ids.pop(path, None)
+        if pid is None:
+            return
+        self.paths[pid] = None
+        self.children.get(posixpath.dirname(path), set()).discard(pid)
+        for child in list(self.children.pop(path, ())):
+            if self.paths[child] is not None:
+                self._remove(self.paths[child])
+        self.dirty = True
+
+    def add(self, path, ftype="f"):
+        with self._lock:
+            self._add(path, ftype)
+            self._tidy()
+
+    def add_many(self, items):
+        with self._lock:
+            for path, ftype in items:
+                self._add(path, ftype)
+            self._tidy()
+
+    def update_dir(self, directory, entries):
+        # A full listing of directory: add its entries, forget vanished ones.
+        # A huge one would only push everything else out, so it is skipped.
+        if len(entries) > PATH_INDEX_DIR_MAX:
+            return
+        with self._lock:
+            fresh = {posixpath.join(directory, e.name): e.type for e in entries}
+            for pid in list(self.children.get(directory, ())):
+                if self.paths[pid] not in fresh:
+                    self._remove(self.paths[pid])
+            for path, ftype in fresh.items():
+                self._add(path, ftype)
+            self._tidy()
+
+    def _tidy(self):
+        # Removed and evicted ids leave holes; rebuild once they dominate
+        if len(self.paths) > 2 * len(self.ids) + 1000:
+            self._compact()
+
+    def _compact(self):
+        # In recency order, so the rebuilt index evicts in the same order
+        live = [(p, self.types[pid]) for p, pid in self.ids.items()]
+        self.paths, self.types, self.ids, self.children, self.postings = [], [], OrderedDict(), {}, {}
+        for path, ftype in live:
+            self._add(path, ftype)
+
+    def query(self, term, limit=50):
+        # Ranked (score, path, type) for paths whose basename matches term.
+        # Trigrams narrow the candidates; name_score decides, with shallower
+        # paths first among equals.
+        term = term.strip().lower()
+        if not term:
+            return []
+        literal = max(re.split(r"[*?]", re.sub(r"\[[^\]]*\]", "*", term)), key=len)
+        grams = trigrams(literal)
+        with self._lock:
+            if grams:
+                lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+                candidates = set(lists[0]).intersection(*lists[1:])
+            else:
+                candidates = range(len(self.paths))
+            results = []
+            for pid in candidates:
+                path = self.paths[pid]
+                if path is None:
+                    continue
+                score = name_score(term, posixpath.basename(path))
+                if score:
+                    results.append((score - min(path.count("/"), 40) * 0.01, path, self.types[pid]))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return results[:limit]
+
+    @staticmethod
+    def confident(term, results):
+        # Enough to skip the host: a known file (not a directory) named
+        # exactly term, or matching it as a glob. A prefix hit such as
+        # ~/work/invoices says nothing about an invoice.pdf not indexed yet.
+        term = term.strip().lower()
+        glob = any(c in term for c in "*?[")
+        return any(ftype != "d" and (glob or posixpath.basename(path).lower() == term)
+                   for _, path, ftype in results)
+
+    def load(self):
+        if not self.file or not os.path.exists(self.file):
+            return
+        try:
+            with gzip.open(self.file, "rt", encoding="utf-8", errors="surrogateescape") as f:
+                items = [line.rstrip("\n").split("\t", 1) for line in f]
+        except (OSError, EOFError):
+            return
+        with self._lock:
+            for item in items:
+                if len(item) == 2:
+                    self._add(item[1], item[0])
+            self.dirty = False
+
+    def save(self):
+        if not self.file or not self.dirty:
+            return
+        with self._lock:
+            # Least recently seen first: load() restores the eviction order
+            lines = [f"{self.types[pid]}\t{p}\n" for p, pid in self.ids.items() if "\n" not in p]
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        tmp = self.file + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8", errors="surrogateescape") as f:
+            f.writelines(lines)
+        os.replace(tmp, self.file)
+
+
+# --- PROMPT CONTEXT ---
+# The directory overview can hold thousands of directories; each AI request
+# gets only the part of it that fits a token budget, picked by how well the
+# path components match the request words, plus the current path, recent
+# navigation and the top of the tree. It is written as an indented tree so
+# shared prefixes appear once and single-child chains fold into "a/b/c/".
+
+# Fixed part of every AI request. The prompt prefix is this, the host list
+# and the top of the current host's tree (ContextBuilder.outline), all
+# byte-identical between requests on a host so the provider can cache it;
+# per-request context goes in a later message.
+AI_INSTRUCTIONS = """
+You are a file manager assistant.
+
+Interpret the user request. Use the Overview to infer paths.
+
+Return ONLY a valid JSON object. Do not add markdown formatting.
+
+Possible actions:
+1. "search": finds a file. Params: "query"; optional "hosts": "all" or a list of host names, only when the user asks to search other/all hosts.
+2. "grep": finds files by content. Params: "pattern"; optional "path" (defaults to the current path), "regex" (true for a regular expression, otherwise a literal string).
+3. "copy": copies a file. Params: "source", "destination", "direction" (to_host or to_client).
+4. "navigate": changes directory. Params: "path".
+5. "question": ask the user for clarification. Params: "text".
+
+If the request needs several of these in a row, return {"plan": [action, ...]} instead, in execution order. In a later step's params, "$1" stands for the path step 1 produced (best search or grep hit, directory navigated to, copy destination), "$1.name" for its file name and "$1.dir" for its directory.
+
+Example: {"action": "search", "params": {"query": "tax_report"} }
+Example: {"action": "grep", "params": {"pattern": "8443", "path": "~/etc"} }
+Example: {"action": "question", "params": {"text": "Did you mean the 2023 or 2024 report?"} }
+Example: {"plan": [{"action": "search", "params": {"query": "invoice_2024-05"} }, {"action": "copy", "params": {"source": "$1", "destination": "~/Desktop/$1.name", "direction": "to_client"} }] }
+"""
+
+STOPWORDS = {"the", "to", "in", "on", "of", "for", "my", "me", "and", "a", "an", "go", "open",
+             "find", "show", "file", "files", "folder", "dir", "directory", "from", "with", "is"}
+
+def query_terms(text):
+    return [stem(w) for w in re.split(r"[^a-z0-9]+", text.lower()) if len(w) > 1 and w not in STOPWORDS]
+
+def stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+def tilde_path(path, home):
+    # The overview's spelling of an absolute path (home shown as ~)
+    if home and (path == home or path.startswith(home.rstrip("/") + "/")):
+        return "~" + path[len(home.rstrip("/")):]
+    return path
+
+
+class ContextBuilder:
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self):
+        self._source = None
+        self._outline = None  # (overview, budget, text)
+        self.paths = []
+        self.known = set()
+        self.children = {}
+
+    def _load(self, overview):
+        # Parse once per overview text
+        if overview is self._source:
+            return
+        paths = [line.rstrip("/") or "/" for line in overview.splitlines() if line.startswith(("~", "/"))]
+        children = {}
+        for path in paths:
+            children.setdefault(posixpath.dirname(path), []).append(path)
+        # Publish the source last: concurrent AI requests share this builder
+        self.paths, self.known, self.children = paths, set(paths), children
+        self._source = overview
+
+    @staticmethod
+    def score(path, terms):
+        # Exact component > prefix > substring; matching the directory itself
+        # counts more than matching one of its ancestors
+        parts = [stem(p) for p in path.lower().split("/")]
+        total = 0.0
+        for term in terms:
+            best = 0.0
+            for i, part in enumerate(parts):
+                if part == term:
+                    s = 3.0
+                elif part.startswith(term):
+                    s = 2.0
+                elif term in part:
+                    s = 1.0
+                else:
+                    continue
+                if i == len(parts) - 1:
+                    s *= 1.5
+                best = max(best, s)
+            total += best
+        return total / (1 + 0.05 * len(parts))
+
+    def _match_scores(self, query):
+        terms = query_terms(query)
+        scores = {}
+        if terms:
+            for path in self.paths:
+                s = self.score(path, terms)
+                if s:
+                    scores[path] = s
+        return scores
+
+    def relevant(self, overview, query, limit=20):
+        # The directories a request's words point at (best first)
+        self._load(overview)
+        scores = self._match_scores(query)
+        return sorted(scores, key=lambda p: (-scores[p], p))[:limit]
+
+    def outline(self, overview, budget=AI_OUTLINE_TOKENS):
+        # The top of the tree, shallowest first, whatever the request: the
+        # same text for every request on this overview, so it can go in the
+        # cached part of the prompt
+        cached = self._outline
+        if cached and cached[0] is overview and cached[1] == budget:
+            return cached[2]
+        text = self.build(overview, "", (), budget)
+        self._outline = (overview, budget, text)
+        return text
+
+    def dirs_named(self, overview, name):
+        # Overview directories whose last component is name (any case)
+        self._load(overview)
+        name = name.lower()
+        return [p for p in self.paths if posixpath.basename(p).lower() == name]
+
+    def _ancestry(self, path):
+        chain = [path]
+        while True:
+            parent = posixpath.dirname(path)
+            if parent == path or parent not in self.known:
+                return chain
+            chain.append(parent)
+            path = parent
+
+    @staticmethod
+    def _cost(path):
+        return len(posixpath.basename(path)) + path.count("/") + 2
+
+    def build(self, overview, query, focus=(), budget=None):
+        # focus: overview-style paths, most important first (current path,
+        # then recently visited ones)
+        self._load(overview)
+        if not self.paths:
+            return overview.strip()
+        budget_chars = (budget or CONTEXT_TOKEN_BUDGET) * self.CHARS_PER_TOKEN
+        scores = self._match_scores(query)
+        for i, path in enumerate(focus):
+            bonus = 2.0 / (1 + i)
+            for p in [path] + self.children.get(path, []):
+                if p in self.known:
+                    scores[p] = scores.get(p, 0) + bonus
+        # Whatever room is left goes to the rest of the tree, shallowest first
+        for path in self.paths:
+            scores.setdefault(path, 0.0)
+
+        selected, used = set(), 0
+        for path in sorted(scores, key=lambda p: (-scores[p], p.count("/"), p)):
+            new = [a for a in self._ancestry(path) if a not in selected]
+            cost = sum(self._cost(a) for a in new)
+            if used + cost > budget_chars:
+                continue
+            selected.update(new)
+            used += cost
+        tree = self._render(selected)
+        if len(selected) < len(self.paths):
+            tree += f"\n({len(selected)} of {len(self.paths)} directories shown, most relevant first)"
+        return tree
+
+    @staticmethod
+    def _render(selected):
+        kids, roots = {}, []
+        for path in sorted(selected):
+            parent = posixpath.dirname(path)
+            if parent != path and parent in selected:
+                kids.setdefault(parent, []).append(path)
+            else:
+                roots.append(path)
+        lines = []
+
+        def walk(path, label, depth):
+            while len(kids.get(path, ())) == 1:
+                path = kids[path][0]
+                label += "/" + posixpath.basename(path)
+            lines.append(" " * depth + label.rstrip("/") + "/")
+            for child in kids.get(path, ()):
+                walk(child, posixpath.basename(child), depth + 1)
+
+        for root in roots:
+            walk(root, root, 0)
+        return "\n".join(lines)
+
+
+# --- AI RESPONSE STREAM ---
+# Incremental scanner over a streamed JSON reply: reports each field as soon
+# as its value is complete, so the action can start before the reply ends
+
+class ActionStream:
+    def __init__(self):
+        self.fields = {}  # "action", "params.path", ... -> value
+        self._stack = []  # (key it sits under, is_object) per open container
+        self._key = None
+        self._expect_key = False
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+
+    def feed(self, text):
+        # Returns the field paths completed by this chunk; a path naming an
+        # object ("params") means the whole object has been read
+        done = []
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(done)
+                    continue
+                self._buf.append(ch)
+                continue
+            if not self._stack and ch != "{":
+                continue  # prose or a ``` fence before the object
+            if ch == '"':
+                self._flush_literal(done)
+                self._in_string, self._buf = True, []
+            elif ch in "{[":
+                self._stack.append((self._key, ch == "{"))
+                self._key, self._expect_key = None, ch == "{"
+            elif ch in "}]":
+                self._flush_literal(done)
+                key, _ = self._stack.pop()
+                path = self._path(key)
+                if ch == "}" and path:
+                    done.append(path)
+                self._key = None
+            elif ch == ":":
+                self._expect_key = False
+            elif ch == ",":
+                self._flush_literal(done)
+                self._expect_key = self._stack[-1][1]
+            elif not ch.isspace():
+                self._buf.append(ch)
+            else:
+                self._flush_literal(done)
+        return done
+
+    def _path(self, key):
+        names = [k for k, _ in self._stack[1:]] + [key]
+        if None in names:
+            return None  # inside an array
+        return ".".join(names)
+
+    def _end_string(self, done):
+        try:
+            value = json.loads('"' + "".join(self._buf) + '"')
+        except ValueError:
+            value = "".join(self._buf)
+        self._buf = []
+        if self._expect_key and self._stack[-1][1]:
+            self._key = value
+        else:
+            self._set(value, done)
+
+    def _flush_literal(self, done):
+        # true / false / null / numbers end at the next delimiter
+        if self._in_string or not self._buf:
+            return
+        raw, self._buf = "".join(self._buf), []
+        try:
+            self._set(json.loads(raw), done)
+        except ValueError:
+            pass
+
+    def _set(self, value, done):
+        path = self._path(self._key)
+        if path:
+            self.fields[path] = value
+            done.append(path)
+        self._key = None
+
+    @staticmethod
+    def params(fields):
+        # The "params" object as read so far
+        return {k[7:]: v for k, v in fields.items() if k.startswith("params.") and "." not in k[7:]}
+
+
+# --- LOCAL INTENTS ---
+# Commands simple enough to need no model: "up", "back", "forward", "home",
+# "go to ~/Downloads", "open projects", "search invoice", "grep 8443 in ~/etc".
+# Anything these patterns don't pin down to one action goes to the AI.
+
+_ARG = r'(?:"(?P<quoted>[^"]+)"|(?P<word>\S+))'
+INTENT_PATTERNS = [
+    ("up", re.compile(r"(?:go\s+)?(?:up|back)|parent(?:\s+(?:folder|directory|dir))?|cd\s+\.\.", re.I)),
+    ("forward", re.compile(r"(?:go\s+)?forward|fwd", re.I)),
+    ("home", re.compile(r"(?:go\s+)?home|cd(?:\s+~/?)?", re.I)),
+    ("navigate", re.compile(r"(?:go\s+to|goto|cd|open|navigate\s+to|switch\s+to|take\s+me\s+to)\s+(?:the\s+|my\s+)?"
+                            r"(?P<target>.+?)(?:\s+(?:folder|directory|dir))?", re.I)),
+    ("search", re.compile(r"(?:search|find|locate|look)\s+(?:for\s+)?" + _ARG, re.I)),
+    ("grep", re.compile(r"grep\s+" + _ARG + r"(?:\s+in\s+(?P<path>\S+))?", re.I)),
+]
+
+def local_intent(command, here, subdirs, dirs_named):
+    # Returns an action dict in the AI's format, or None when the command
+    # is ambiguous. subdirs: directory names in the current listing;
+    # dirs_named(name): overview directories with that name.
+    # Sentence punctuation goes, but a full stop only after a word: "cd .."
+    # keeps its dots
+    text = re.sub(r"(?<=[\w\"'])\.+$", "", command.strip().rstrip("!"))
+    text = re.sub(r"^please\s+", "", text, flags=re.I).strip()
+    for kind, pattern in INTENT_PATTERNS:
+        m = pattern.fullmatch(text)
+        if not m:
+            continue
+        if kind in ("up", "forward"):
+            return {"action": kind, "params": {}}
+        if kind == "home":
+            return {"action": "navigate", "params": {"path": "~"}}
+        if kind == "search":
+            return {"action": "search", "params": {"query": m["quoted"] or m["word"]}}
+        if kind == "grep":
+            params = {"pattern": m["quoted"] or m["word"]}
+            if m["path"]:
+                params["path"] = m["path"]
+            return {"action": "grep", "params": params}
+        target = m["target"].strip().strip('"')
+        if target.startswith(("/", "~")):
+            return {"action": "navigate", "params": {"path": target}}
+        # A bare name: a subdirectory right here, else a unique overview match
+        here_matches = [d for d in subdirs if d.lower() == target.lower()]
+        if len(here_matches) == 1:
+            return {"action": "navigate", "params": {"path": posixpath.join(here, here_matches[0])}}
+        if not here_matches and "/" not in target:
+            found = dirs_named(target)
+            if len(found) == 1:
+                return {"action": "navigate", "params": {"path": found[0]}}
+        return None
+    return None
+
+
+# --- ACTION PLANS ---
+# A compound request comes back as {"plan": [step, ...]}; each step is an
+# ordinary action whose string params may use "$N" (the path step N produced),
+# "$N.name" or "$N.dir". Steps start as soon as the steps they reference have
+# finished, so independent lookups overlap; a write step or one that moves
+# the view also waits for every step before it, and steps sharing the results
+# panel run one at a time. Search and grep steps don't open their hit, so the
+# view only moves where the plan says.
+
+ORDERED_ACTIONS = ("copy", "navigate")  # wait for every earlier step
+PANEL_ACTIONS = ("search", "grep")
+_STEP_REF = re.compile(r"\$(\d+)(?:\.(name|dir))?")
+
+class PlanExecutor:
+    def __init__(self, steps, run_step, log):
+        # run_step(action, params, on_done) starts one step on the Tk thread
+        # and calls on_done(path) when it finishes (None: failed/nothing found)
+        self.steps = steps
+        self.run_step = run_step
+        self.log = log
+        self.results = {}
+        self.started = set()
+        self.stopped = False
+
+    @staticmethod
+    def refs(step):
+        found = set()
+        for value in (step.get("params") or {}).values():
+            if isinstance(value, str):
+                found.update(int(m.group(1)) for m in _STEP_REF.finditer(value))
+        return found
+
+    def start(self):
+        for n, step in enumerate(self.steps, 1):
+            # Shape first: refs() and everything after assume dict params
+            if (not isinstance(step, dict) or not isinstance(step.get("params") or {}, dict)
+                    or any(not 0 < r < n for r in self.refs(step))):
+                self.log(f"System: Plan step {n} is invalid; nothing was run.")
+                return
+        self._advance()
+
+    def _ready(self, n, step):
+        if not self.refs(step) <= self.results.keys():
+            return False
+        action = step.get("action")
+        earlier = range(1, n)
+        if action in ORDERED_ACTIONS:
+            return all(i in self.results for i in earlier)
+        if action in PANEL_ACTIONS:
+            return all(i in self.results for i in earlier if self.steps[i - 1].get("action") in PANEL_ACTIONS)
+        return True
+
+    def _advance(self):
+        for n, step in enumerate(self.steps, 1):
+            if self.stopped:
+                return
+            if n in self.started or not self._ready(n, step):
+                continue
+            self.started.add(n)
+            params = {k: self._fill(v) for k, v in (step.get("params") or {}).items()}
+            self.run_step(step.get("action"), params, lambda path, n=n: self._finished(n, path))
+
+    def _fill(self, value):
+        if not isinstance(value, str):
+            return value
+
+        def sub(m):
+            path = self.results[int(m.group(1))]
+            if m.group(2) == "name":
+                return posixpath.basename(path)
+            if m.group(2) == "dir":
+                return posixpath.dirname(path)
+            return path
+        return _STEP_REF.sub(sub, value)
+
+    def _finished(self, n, path):
+        if self.stopped:
+            return
+        if path is None:
+            self.stopped = True
+            self.log(f"System: Plan stopped at step {n}; the steps after it were not run.")
+            return
+        self.results[n] = path
+        if len(self.results) == len(self.steps):
+            self.log(f"System: Plan finished ({len(self.steps)} steps).")
+            return
+        self._advance()
+
+
+# --- PREFETCHER ---
+# Warms the listing/preview caches with what the user is likely to open next
+# (subdirectories of the directory just shown, the hovered or selected row,
+# neighbours of the selected file). Work is prioritized (lower runs first),
+# re-prioritized when the user hovers/selects, and limited to a few
+# concurrent requests per host so it never saturates the link.
+
+class Prefetcher:
+    def __init__(self, workers=4, per_host=PREFETCH_PER_HOST, max_queue=256):
+        self.per_host = per_host
+        self.max_queue = max_queue
+        self._heap = []
+        self._prio = {}  # (host, path) -> current priority, drops stale heap items
+        self._jobs = {}
+        self._active = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def schedule(self, host, path, fn, priority):
+        # fn() does the fetch and fills a cache; errors are ignored
+        key = (host, path)
+        with self._cond:
+            if key in self._prio and self._prio[key] <= priority:
+                return
+            if key not in self._prio and len(self._prio) >= self.max_queue:
+                return
+            self._prio[key] = priority
+            self._jobs[key] = fn
+            heapq.heappush(self._heap, (priority, next(self._seq), key))
+            self._cond.notify()
+
+    def clear(self, host=None):
+        with self._cond:
+            for key in [k for k in self._prio if host is None or k[0] == host]:
+                del self._prio[key]
+                del self._jobs[key]
+
+    def _next_job(self):
+        # Highest priority job whose host still has budget (call with lock held)
+        skipped, job = [], None
+        while self._heap:
+            prio, seq, key = heapq.heappop(self._heap)
+            if self._prio.get(key) != prio:
+                continue  # cleared or re-prioritized
+            if self._active.get(key[0], 0) >= self.per_host:
+                skipped.append((prio, seq, key))
+                continue
+            del self._prio[key]
+            job = (key, self._jobs.pop(key))
+            break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                (host, _), fn = job
+                self._active[host] = self._active.get(host, 0) + 1
+            try:
+                fn()
+            except Exception:
+                pass
+            finally:
+                with self._cond:
+                    self._active[host] -= 1
+                    self._cond.notify_all()
+
+
+# --- CONNECTION POOL ---
+# Authenticated transports (with their SFTP session, agent and explorer state)
+# are kept per host profile, so flipping the host dropdown back and forth
+# doesn't redo TCP, key exchange, auth, deploy and fs_overview each time.
+
+class HostConnection:
+    def __init__(self, name, profile, key_path):
+        self.name = name
+        self.profile = profile
+        self.key_path = key_path
+        self.ssh = None
+        self.sftp = None
+        self.agent = None
+        self.last_used = time.time()
+        self.caps = {}
+        self.impl = pick_impls({})
+        # Explorer state restored when the user switches back to this host
+        self.fs_context = ""
+        self.home = None  # remote $HOME, to resolve relative paths
+        self.current_path = "."
+        self.history_back = []
+        self.history_fwd = []
+        self.log = lambda text: None
+        # on_reconnect(conn), called on the reconnecting thread after the
+        # transport or agent was replaced (the explorer re-binds on Tk)
+        self.on_reconnect = None
+        self._ensure_lock = threading.Lock()
+
+    def open(self, log):
+        import paramiko
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # Assumes SSH Key Auth. Use connect(password=...) if needed.
+        # Bounded: an unreachable host must not hold a worker indefinitely
+        ssh.connect(self.profile.get("host", HOST), username=self.profile.get("user", USER), key_filename=self.key_path,
+                    timeout=CONNECT_TIMEOUT, banner_timeout=CONNECT_TIMEOUT, auth_timeout=CONNECT_TIMEOUT)
+        ssh.get_transport().set_keepalive(int(self.profile.get("keepalive", KEEPALIVE_INTERVAL)))
+        self.ssh = ssh
+        self.sftp = ssh.open_sftp()
+
+        # --- DEPLOY HOST FUNCTIONS ---
+        # Upload local host_functions.zsh to remote home as .host_functions.zsh
+        if os.path.exists(LOCAL_SCRIPT):
+            try:
+                self.deploy_script(log)
+            except Exception as up_e:
+                log(f"Warning: Failed to deploy host_functions.zsh: {up_e}")
+        else:
+            log("Warning: Local host_functions.zsh not found! Remote features may fail.")
+
+        try:
+            self.agent = HostAgent.over_ssh(ssh)
+        except Exception as e:
+            self.agent = None
+            log(f"Warning: Host agent unavailable, using per-call commands: {e}")
+
+    def deploy_script(self, log):
+        # Only upload when the deployed copy differs: compare our sha256 with
+        # the stamp written next to it last time (plus size, in case someone
+        # edited the remote copy by hand).
+        digest = script_digest()
+        stamp = REMOTE_SCRIPT + ".sha256"
+        try:
+            with self.sftp.open(stamp, "r") as f:
+                remote_digest = f.read().decode().strip()
+            remote_size = self.sftp.stat(REMOTE_SCRIPT).st_size
+        except IOError:
+            remote_digest, remote_size = None, None
+
+        if remote_digest == digest and remote_size == os.path.getsize(LOCAL_SCRIPT):
+            log(f"System: Host functions up to date ({digest[:12]}).")
+            return
+        log("System: Deploying host functions to remote...")
+        self.sftp.put(LOCAL_SCRIPT, REMOTE_SCRIPT)
+        with self.sftp.open(stamp, "w") as f:
+            f.write(digest + "\n")
+
+    def is_active(self):
+        transport = self.ssh.get_transport() if self.ssh else None
+        return bool(transport and transport.is_active())
+
+    def ensure(self, log=None):
+        # Transparently reconnect a transport that dropped underneath us
+        # (serialized: a background search may race the explorer for it).
+        # Safe on any thread; touches no explorer state.
+        if log:
+            self.log = log
+        replaced = False
+        with self._ensure_lock:
+            self.last_used = time.time()
+            if not self.is_active():
+                if self.ssh:
+                    self.log(f"System: Connection to '{self.name}' dropped, reconnecting...")
+                    replaced = True
+                self.close()
+                self.open(self.log)
+            elif self.agent and not self.agent.alive:
+                try:
+                    self.agent = HostAgent.over_ssh(self.ssh)
+                except Exception:
+                    self.agent = None
+                replaced = True
+        if replaced and self.on_reconnect:
+            self.on_reconnect(self)
+        return self
+
+    def live_sftp(self):
+        return self.ensure().sftp
+
+    # All remote commands for this host go through these (the explorer's
+    # run_remote_* too), so they always use this host's live transport
+    def run_raw(self, cmd):
+        self.ensure()
+        agent = self.agent
+        if agent and agent.alive:
+            try:
+                return agent.submit(cmd).read()
+            except AgentCancelled:
+                raise  # the caller gave up; don't re-run it another way
+            except Exception as e:
+                self.log(f"Warning: Host agent failed ({e}), using per-call commands.")
+                self.agent = None
+        # Fallback path only: the resident agent normally keeps the script
+        # sourced, here we have to source it again for every exec_command
+        _, stdout, _ = self.ssh.exec_command(f"source ~/{REMOTE_SCRIPT}; {cmd}")
+        return stdout.read()
+
+    def stream(self, cmd):
+        # Generator of stdout chunks as they arrive (for long listings/searches)
+        self.ensure()
+        agent = self.agent
+        if agent and agent.alive:
+            call = agent.submit(cmd)
+            try:
+                yield from call.iter_chunks()
+            finally:
+                # Stop the host side too if the consumer gave up early
+                if not call.done.is_set():
+                    call.cancel()
+            return
+
+        task = current_task()
+        _, stdout, _ = self.ssh.exec_command(f"source ~/{REMOTE_SCRIPT}; {cmd}")
+        chan = stdout.channel
+        if task:
+            task.on_cancel(chan.close)
+        try:
+            while True:
+                chunk = chan.recv(65536)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            chan.close()
+
+    def prepare(self):
+        # Capabilities and $HOME, for hosts connected outside the explorer
+        if not self.caps:
+            self.caps = parse_caps(self.run_raw("fs_caps").decode(errors="replace"))
+            self.impl = pick_impls(self.caps)
+        if not self.home:
+            self.home = self.run_raw('print -r -- "$HOME"').decode(errors="replace").strip() or "."
+
+    def shell_backend(self):
+        return ShellBackend(lambda cmd: self.run_raw(cmd).decode(errors="replace").strip(),
+                            lambda op: self.impl.get(op) or HOST_IMPLS[op][-1][0],
+                            self.run_raw, self.stream)
+
+    def idle_for(self):
+        return time.time() - self.last_used
+
+    def close(self):
+        for res in (self.agent, self.sftp, self.ssh):
+            try:
+                if res:
+                    res.close()
+            except Exception:
+                pass
+        self.ssh = self.sftp = self.agent = None
+
+
+class ConnectionPool:
+    def __init__(self, janitor_interval=30):
+        self._conns = {}
+        self._lock = threading.Lock()
+        self.active_name = None
+        threading.Thread(target=self._janitor, args=(janitor_interval,), daemon=True).start()
+
+    def get(self, name, profile, key_path, log, activate=True):
+        with self._lock:
+            conn = self._conns.get(name)
+            if conn and (conn.profile != profile or conn.key_path != key_path):
+                # Profile was edited in Settings; the old transport is stale
+                conn.close()
+                conn = None
+            if not conn:
+                conn = HostConnection(name, profile, key_path)
+                self._conns[name] = conn
+            if activate:
+                self.active_name = name
+        try:
+            return conn.ensure(log)
+        except Exception:
+            self.discard(name)
+            raise
+
+    def peek(self, name):
+        with self._lock:
+            return self._conns.get(name)
+
+    def discard(self, name):
+        with self._lock:
+            conn = self._conns.pop(name, None)
+        if conn:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            conns = list(self._conns.values())
+            self._conns.clear()
+        for conn in conns:
+            conn.close()
+
+    def _janitor(self, interval):
+        # Evict hosts nobody has looked at for a while (never the active one)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                idle = [c for n, c in self._conns.items()
+                        if n != self.active_name and c.idle_for() > float(c.profile.get("idle_timeout", IDLE_TIMEOUT))]
+                for c in idle:
+                    self._conns.pop(c.name, None)
+            for c in idle:
+                c.close()
+
+
+# --- VIRTUAL FILE VIEW ---
+# Every entry of the current directory lives in a Python list; the Treeview
+# only ever holds the rows that fit on screen. Scrolling moves a window over
+# the list, so a directory with hundreds of thousands of entries costs the
+# same few dozen widget rows as a small one.
+
+class VirtualTree:
+    def __init__(self, tree, scrollbar, on_select, rowheight=32):
+        self.tree = tree
+        self.sb = scrollbar
+        self.on_select = on_select
+        self.rowheight = rowheight
+        self.entries = []
+        self.pending = []  # streamed entries not merged into the sorted list yet
+        self.offset = 0
+        self.rows = 20
+        self.selected = None  # FileEntry
+        self.sort_column = "name"
+        self.sort_reverse = False
+
+        self.sb.configure(command=self.yview)
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Up>", lambda e: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self.move_selection(-self.rows))
+        self.tree.bind("<Next>", lambda e: self.move_selection(self.rows))
+        self.tree.bind("<Home>", lambda e: self.move_selection(-len(self.entries)))
+        self.tree.bind("<End>", lambda e: self.move_selection(len(self.entries)))
+
+    # --- data ---
+    def _key(self):
+        if self.sort_column == "size":
+            return lambda e: (e.type != "d", e.size if e.size is not None else -1, e.name)
+        return FileEntry.sort_key
+
+    def set_entries(self, entries, keep_selection=False, presorted=False):
+        selected = self.selected if keep_selection else None
+        self.entries = list(entries)
+        self.pending = []
+        if not (presorted and self.sort_column == "name" and not self.sort_reverse):
+            self.entries.sort(key=self._key(), reverse=self.sort_reverse)
+        self.selected = None
+        if selected is not None:
+            for e in self.entries:
+                if e.name == selected.name:
+                    self.selected = e
+                    break
+        if not keep_selection:
+            self.offset = 0
+        self.render()
+
+    def extend(self, batch):
+        # Streaming: merge geometrically so total sort work stays O(n log n)
+        # no matter how many small batches arrive
+        self.pending.extend(batch)
+        if len(self.pending) >= max(500, len(self.entries) // 4) or not self.entries:
+            self.entries.extend(self.pending)
+            self.pending = []
+            self.entries.sort(key=self._key(), reverse=self.sort_reverse)
+            self.render()
+
+    def sort_by(self, column):
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, False
+        self.set_entries(self.entries + self.pending, keep_selection=True)
+        self._scroll_to_selected()
+
+    def count(self):
+        return len(self.entries) + len(self.pending)
+
+    # --- selection ---
+    def selected_entry(self):
+        return self.selected
+
+    def _index_of(self, entry):
+        try:
+            return self.entries.index(entry)
+        except ValueError:
+            return None
+
+    def select_index(self, index, notify=True):
+        if not self.entries:
+            return
+        index = max(0, min(index, len(self.entries) - 1))
+        self.selected = self.entries[index]
+        self._scroll_to_selected()
+        if notify:
+            self.on_select(self.selected)
+
+    def select_name(self, name):
+        for i, e in enumerate(self.entries):
+            if e.name == name:
+                self.select_index(i)
+                return True
+        return False
+
+    def select_at(self, y):
+        # Row under the pointer (context menu)
+        iid = self.tree.identify_row(y)
+        if iid:
+            self.select_index(int(iid))
+        return bool(iid)
+
+    def entry_at(self, y):
+        iid = self.tree.identify_row(y)
+        return self.entries[int(iid)] if iid and int(iid) < len(self.entries) else None
+
+    def neighbours(self, entry):
+        index = self._index_of(entry)
+        if index is None:
+            return []
+        return [self.entries[i] for i in (index + 1, index - 1) if 0 <= i < len(self.entries)]
+
+    def move_selection(self, delta):
+        index = self._index_of(self.selected) if self.selected is not None else None
+        self.select_index(0 if index is None else index + delta)
+        return "break"
+
+    def _on_tree_select(self, event=None):
+        sel = self.tree.selection()
+        if not sel:
+            return  # Selected row merely scrolled out of the window
+        entry = self.entries[int(sel[0])] if int(sel[0]) < len(self.entries) else None
+        if entry is not None and entry is not self.selected:
+            self.selected = entry
+            self.on_select(entry)
+
+    # --- viewport ---
+    def _on_resize(self, event):
+        rows = max(1, event.height // self.rowheight - 1)  # minus the heading
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+    def _scroll_to_selected(self):
+        index = self._index_of(self.selected)
+        if index is not None:
+            if index < self.offset:
+                self.offset = index
+            elif index >= self.offset + self.rows:
+                self.offset = index - self.rows + 1
+        self.render()
+
+    def scroll(self, rows):
+        self.offset += rows
+        self.render()
+        return "break"
+
+    def yview(self, *args):
+        # Scrollbar protocol: ("moveto", fraction) or ("scroll", n, "units"|"pages")
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.entries))
+        elif args[0] == "scroll":
+            step = self.rows if args[2] == "pages" else 1
+            self.offset += int(args[1]) * step
+        self.render()
+
+    def render(self):
+        total = len(self.entries)
+        self.offset = max(0, min(self.offset, total - self.rows))
+        self.tree.delete(*self.tree.get_children())
+        end = min(total, self.offset + self.rows)
+        for i in range(self.offset, end):
+            e = self.entries[i]
+            fsize = e.size if e.size is not None else "?"
+            # No icons, just color coding tags
+            self.tree.insert("", "end", iid=str(i), text=f" {e.name}", values=(fsize,),
+                             tags=('dir',) if e.is_dir else ('file',))
+        index = self._index_of(self.selected) if self.selected is not None else None
+        if index is not None and self.offset <= index < end:
+            self.tree.selection_set(str(index))
+            self.tree.focus(str(index))
+        if total:
+            self.sb.set(self.offset / total, end / total)
+        else:
+            self.sb.set(0, 1)
+
 class RemoteExplorer(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -47,10 +2443,26 @@ class RemoteExplorer(tk.Tk):
         self.geometry("1200x700")
         self.minsize(900, 600) # Prevent sizing too small
         
-        # SSH Client Setup
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # SSH Client Setup (connections live in the pool, these point at the active one)
+        self.pool = ConnectionPool()
+        self.conn = None
+        self.ssh = None
         self.sftp = None
+        self.agent = None  # Resident host agent (see HostAgent)
+        self.caps = {}
+        self.impl = pick_impls({})
+        self.backend = LocalBackend()  # Replaced once we know the host
+        self.listing_cache = ListingCache()
+        self.preview_cache = PreviewCache(disk_dir=os.path.join(CACHE_DIR, "previews"))
+        self.prefetcher = Prefetcher()
+        self.context_builder = ContextBuilder()
+        self.ai_cache = ResponseCache(os.path.join(CACHE_DIR, "ai_responses.json"))
+        self.ai_cache.load()
+        self.path_indexes = {}  # host -> PathIndex of paths seen there
+        self.path_index_lock = threading.Lock()
+        self.home = os.path.expanduser("~")
+        self.hovered_entry = None
+        self.preview_timer = None
         self.current_path = os.getcwd() # Default to current dir for local mode
         self.use_local_mode = False
         self.fs_context = ""  # Store the file system overview
@@ -71,15 +2483,41 @@ class RemoteExplorer(tk.Tk):
             self.destroy()
             return
 
-        self.ai_client = OpenAI(api_key=OPENAI_KEY)
+        self._ai_client = None  # created on first use (see get_ai_client)
+        self.startup_marks = {}
 
         # Load settings after GUI init variables are in place
         self.settings = self.load_settings()
         self.active_host_name = list(self.settings.keys())[0] if self.settings else "default"
 
+        self.engine = TaskEngine(self)
+        self.ai_scheduler = AIScheduler(self.engine.call_soon, on_retry=self.on_ai_retry,
+                                        on_idle=self.stop_loading_animation)
         self.create_gui()
+        self.after_idle(self.on_first_paint)
         self.connect_ssh()
 
+    def mark_startup(self, stage):
+        # Record how long after launch a startup stage was reached (once)
+        if stage in self.startup_marks:
+            return
+        self.startup_marks[stage] = (time.perf_counter() - STARTUP_T0) * 1000
+        if stage == "first listing":
+            marks = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.startup_marks.items())
+            self.log_ai(f"System: Startup: {marks}")
+
+    def on_first_paint(self):
+        self.mark_startup("first paint")
+        # Warm up what the first AI request and the tray need, off the Tk thread
+        self.engine.submit(lambda task: self.get_ai_client())
+        self.setup_tray_icon()
+
+    def get_ai_client(self):
+        if self._ai_client is None:
+            from openai import OpenAI
+            self._ai_client = OpenAI(api_key=OPENAI_KEY)
+        return self._ai_client
+
     def create_gui(self):
         # --- STYLES ---
         style = ttk.Style()
@@ -207,9 +2645,9 @@ class RemoteExplorer(tk.Tk):
         tree_frame = tk.Frame(self.frame_mid, bg=COLORS["panel"])
         tree_frame.pack(expand=True, fill="both", padx=0, pady=0)
         
-        self.tree = ttk.Treeview(tree_frame, columns=("Size"), show="tree headings", style="Treeview")
-        self.tree.heading("#0", text="  Name", anchor="w")
-        self.tree.heading("Size", text="Size  ", anchor="e")
+        self.tree = ttk.Treeview(tree_frame, columns=("Size"), show="tree headings", style="Treeview", selectmode="browse")
+        self.tree.heading("#0", text="  Name", anchor="w", command=lambda: self.file_view.sort_by("name"))
+        self.tree.heading("Size", text="Size  ", anchor="e", command=lambda: self.file_view.sort_by("size"))
         self.tree.column("#0", anchor="w")
         self.tree.column("Size", width=120, anchor="e")
         
@@ -217,16 +2655,22 @@ class RemoteExplorer(tk.Tk):
         self.tree.tag_configure('dir', foreground=COLORS["dir_color"], font=FONT_BOLD)
         self.tree.tag_configure('file', foreground=COLORS["file_color"], font=FONT_MAIN)
         
-        # Scrollbar
-        sb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=sb.set)
+        # Scrollbar (driven by the virtual view, not the Treeview itself)
+        sb = ttk.Scrollbar(tree_frame, orient="vertical")
         
         self.tree.pack(side="left", expand=True, fill="both")
         sb.pack(side="right", fill="y")
+        self.file_view = VirtualTree(self.tree, sb, self.on_single_select)
         
         # Bindings
         self.tree.bind("<Double-1>", self.on_double_click)
-        self.tree.bind("<<TreeviewSelect>>", self.on_single_select)
+        self.tree.bind("<Return>", self.on_double_click)
+        self.tree.bind("<Button-3>", self.show_context_menu)
+        self.tree.bind("<Motion>", self.on_tree_hover)
+
+        # Context Menu
+        self.context_menu = tk.Menu(self, tearoff=0, bg=COLORS["panel"], fg=COLORS["fg"], font=FONT_MAIN)
+        self.context_menu.add_command(label="Download to Local", command=self.download_selection)
         
         # Navigation Bar
         nav_frame = tk.Frame(self.frame_mid, bg=COLORS["panel"], pady=10, padx=10)
@@ -235,8 +2679,10 @@ class RemoteExplorer(tk.Tk):
         # Using symbols instead of text for buttons for a cleaner look
         ttk.Button(nav_frame, text="←", command=self.go_back, width=4).pack(side="left", padx=(0, 5))
         ttk.Button(nav_frame, text="→", command=self.go_fwd, width=4).pack(side="left", padx=5)
-        ttk.Button(nav_frame, text="⟳ Refresh", command=self.refresh_files).pack(side="left", padx=5)
+        ttk.Button(nav_frame, text="⟳ Refresh", command=lambda: self.refresh_files(force=True)).pack(side="left", padx=5)
         ttk.Button(nav_frame, text="Settings", command=self.open_settings_dialog).pack(side="right", padx=5)
+        ttk.Button(nav_frame, text="Index", command=self.open_index_dialog).pack(side="right", padx=5)
+        ttk.Button(nav_frame, text="Hosts", command=self.open_fanout_dialog).pack(side="right", padx=5)
 
         # --- RIGHT PANE: AI Command ---
         self.frame_right = tk.Frame(self.paned_window, bg=COLORS["panel"])
@@ -253,9 +2699,36 @@ class RemoteExplorer(tk.Tk):
         self.chat_history = scrolledtext.ScrolledText(self.frame_right, state='disabled', height=10, bg=COLORS["panel"], fg=COLORS["fg"], insertbackground="white", relief="flat", font=("Roboto", 10), highlightthickness=0, borderwidth=0, padx=15, pady=15)
         self.chat_history.grid(row=1, column=0, sticky="nsew")
         
+        # Search results (shown while/after a search runs)
+        self.search_frame = tk.Frame(self.frame_right, bg=COLORS["panel"], padx=10)
+        self.search_frame.grid(row=2, column=0, sticky="ew")
+        search_bar = tk.Frame(self.search_frame, bg=COLORS["panel"])
+        search_bar.pack(fill="x", pady=(5, 5))
+        self.search_status = tk.Label(search_bar, text="", bg=COLORS["panel"], fg=COLORS["fg_dim"], font=FONT_MAIN, anchor="w")
+        self.search_status.pack(side="left", fill="x", expand=True)
+        ttk.Button(search_bar, text="✕", command=self.close_search_panel, width=3).pack(side="right")
+        self.search_cancel_btn = ttk.Button(search_bar, text="Cancel", command=self.cancel_search)
+        self.search_cancel_btn.pack(side="right", padx=5)
+        self.search_tree = ttk.Treeview(self.search_frame, columns=("Where",), show="tree", style="Treeview", selectmode="browse", height=6)
+        self.search_tree.column("#0", width=160, anchor="w")
+        self.search_tree.column("Where", anchor="w")
+        self.search_tree.tag_configure('dir', foreground=COLORS["dir_color"], font=FONT_BOLD)
+        self.search_tree.tag_configure('file', foreground=COLORS["file_color"], font=FONT_MAIN)
+        self.search_tree.pack(fill="x")
+        self.search_tree.bind("<Double-1>", self.on_search_hit_open)
+        self.search_tree.bind("<Return>", self.on_search_hit_open)
+        self.search_frame.grid_remove()
+        self.search_hits = []  # (host, FileEntry), best first
+        self.grep_lines = []  # (line, text) per hit, for content searches
+        self.search_query = ""
+        self.search_multi = False
+        self.search_opened = False
+        self.pending_hit = None  # path to open once a host switch connects
+        self.fanout_hosts = []  # profiles for multi-host search (empty = all)
+
         # Input Area (Fixed at bottom)
         input_container = tk.Frame(self.frame_right, bg=COLORS["panel"], pady=15, padx=15)
-        input_container.grid(row=2, column=0, sticky="ew")
+        input_container.grid(row=3, column=0, sticky="ew")
         
         # Spinner
         self.spinner_canvas = tk.Canvas(input_container, width=24, height=24, bg=COLORS["panel"], highlightthickness=0)
@@ -266,19 +2739,17 @@ class RemoteExplorer(tk.Tk):
         self.prompt_entry = tk.Entry(input_container, bg=COLORS["input"], fg="#ffffff", insertbackground="white", relief="flat", font=("Roboto", 11))
         self.prompt_entry.pack(fill="x", ipady=10)
         self.prompt_entry.bind("<Return>", self.process_ai_command)
+        self.prompt_entry.bind("<Escape>", self.cancel_ai_commands)
         
         # Send Button with accent
         tk.Frame(input_container, height=10, bg=COLORS["panel"]).pack() # Spacer
         ttk.Button(input_container, text="EXECUTE", command=self.process_ai_command, style="Accent.TButton", width=100).pack(fill="x")
+        self.ai_stats_label = tk.Label(input_container, text="", bg=COLORS["panel"], fg=COLORS["fg_dim"], font=("Roboto", 8), anchor="e")
+        self.ai_stats_label.pack(fill="x", pady=(6, 0))
         
         # Store colors
         self.COLORS = COLORS
 
-        # Tray icon setup (if pystray is available)
-        if pystray:
-            self.after(0, self.setup_tray_icon)
-        else:
-            self.log_ai("Warning: pystray not installed; tray icon disabled.")
 
     # --- SETTINGS / HOST PROFILES ---
     def load_settings(self):
@@ -342,24 +2813,83 @@ class RemoteExplorer(tk.Tk):
         # As last resort, None (paramiko will try agent if available)
         return None
 
-    def on_host_change(self, event=None):
-        # Switch active host profile and reconnect
+    def on_host_change(self, event=None, keep_search=False):
+        # Switch active host profile. The previous connection stays pooled
+        # (with its path and history) so switching back is instant.
+        self.save_host_state()
+        for key in ("connect", "listing", "preview", "overview"):
+            self.engine.cancel(key)
+        self.prefetcher.clear()  # speculative work for the old host is moot
+        if not keep_search:
+            self.close_search_panel()
         self.active_host_name = self.host_var.get()
-        # Close existing SSH if any
-        try:
-            if self.sftp:
-                self.sftp.close()
-            if self.ssh:
-                self.ssh.close()
-        except:
-            pass
+        if self.use_local_mode and self.agent:
+            self.agent.close()
+        self.use_local_mode = False
+        self.conn = None
+        self.ssh = self.sftp = self.agent = None
         # Reset state
         self.current_path = "."
-        self.history_back.clear()
-        self.history_fwd.clear()
-        # Reconnect
+        self.history_back = []
+        self.history_fwd = []
+        # Reconnect (or reuse the pooled connection)
         self.connect_ssh()
 
+    def save_host_state(self):
+        if self.conn:
+            self.conn.current_path = self.current_path
+            self.conn.history_back = self.history_back
+            self.conn.history_fwd = self.history_fwd
+            self.conn.fs_context = self.fs_context
+
+    def bind_connection(self, conn):
+        self.conn = conn
+        conn.on_reconnect = lambda c: self.engine.call_soon(self.on_reconnected, c)
+        self.ssh, self.sftp, self.agent = conn.ssh, conn.sftp, conn.agent
+        self.caps, self.impl = conn.caps, conn.impl
+        self.home = conn.home or self.home
+        if conn.home:
+            self.listing_cache.homes[self.cache_host()] = conn.home
+        self.backend = self.make_backend()
+
+    @staticmethod
+    def probe_host(run):
+        # Worker side: which tools the host has and where its home is, in one
+        # round trip through run(cmd) -> text. Touches no explorer state; the
+        # caller applies the result on the Tk thread.
+        try:
+            text = run('fs_caps; print -r -- "home=$HOME"')
+        except AgentCancelled:
+            raise
+        except Exception:
+            text = ""
+        caps = parse_caps(text)
+        caps.pop("home", None)
+        home = next((line[5:] for line in text.splitlines() if line.startswith("home=")), "")
+        return caps, home
+
+    def apply_caps(self, caps, home):
+        # Tk thread: adopt a probe_host result for the host being browsed
+        if home:
+            self.home = home
+        self.caps, self.impl = caps, pick_impls(caps)
+        self.backend = self.make_backend()
+        self.log_host_tools(caps)
+
+    def log_host_tools(self, caps):
+        tools = ", ".join(k for k, v in caps.items() if v)
+        self.log_ai(f"System: Host tools: {tools or 'none detected'}")
+
+    def host_fn(self, op):
+        # Name of the host function implementing op on the current host
+        return self.impl.get(op) or HOST_IMPLS[op][-1][0]
+
+    def on_reconnected(self, conn):
+        # Tk thread: a worker re-opened conn's transport (HostConnection.ensure);
+        # re-mirror it unless the user has moved to another host since
+        if conn is self.conn and not self.use_local_mode:
+            self.bind_connection(conn)
+
     def open_settings_dialog(self):
         dlg = tk.Toplevel(self)
         dlg.title("Host Settings")
@@ -427,11 +2957,15 @@ class RemoteExplorer(tk.Tk):
             if not name:
                 messagebox.showwarning("Missing name", "Please enter a profile name.")
                 return
-            self.settings[name] = {
+            # Merge: keepalive, idle_timeout, backend etc. aren't in this
+            # form, and dropping them would also make the pool reconnect
+            profile = dict(self.settings.get(name, {}))
+            profile.update({
                 "host": host_var.get().strip(),
                 "user": user_var.get().strip(),
                 "key_path": key_var.get().strip()
-            }
+            })
+            self.settings[name] = profile
             self.save_settings()
             load_list()
             self.refresh_host_dropdown(select_name=name)
@@ -444,6 +2978,7 @@ class RemoteExplorer(tk.Tk):
                 messagebox.showwarning("Not allowed", "Cannot delete default profile.")
                 return
             self.settings.pop(name, None)
+            self.pool.discard(name)
             self.save_settings()
             load_list()
             self.refresh_host_dropdown()
@@ -454,139 +2989,423 @@ class RemoteExplorer(tk.Tk):
 
         load_list()
 
-        # Context Menu
-        self.context_menu = tk.Menu(self, tearoff=0, bg=COLORS["panel"], fg=COLORS["fg"], font=FONT_MAIN)
-        self.context_menu.add_command(label="Download to Local", command=self.download_selection)
-        
-        self.tree.bind("<Button-3>", self.show_context_menu)
+    def open_index_dialog(self):
+        # Status of the host's path index (age, size) with a manual rebuild
+        dlg = tk.Toplevel(self)
+        dlg.title("Search Index")
+        dlg.configure(bg=self.COLORS["panel"])
+        dlg.geometry("420x180")
+        dlg.resizable(False, False)
+
+        info_label = tk.Label(dlg, text="Loading...", bg=self.COLORS["panel"], fg=self.COLORS["fg"], justify="left", anchor="w")
+        info_label.pack(fill="both", expand=True, padx=15, pady=10)
+        btn_frame = tk.Frame(dlg, bg=self.COLORS["panel"])
+        btn_frame.pack(fill="x", padx=10, pady=10)
+
+        if self.use_local_mode or self.host_fn("search") != "fs_index_search":
+            info_label.config(text="This host searches without an index\n(local mode or no GNU find).")
+            tk.Button(btn_frame, text="Close", command=dlg.destroy, bg=self.COLORS["input"], fg=self.COLORS["fg"], relief="flat", padx=10, pady=4).pack(side="right", padx=4)
+            return
+
+        def show(text):
+            if not dlg.winfo_exists():
+                return
+            info = dict(line.partition("=")[::2] for line in text.splitlines() if "=" in line)
+            if info.get("exists") != "1":
+                info_label.config(text="No index yet. It is built on the first search,\nor press Rebuild.")
+                return
+            now = time.time()
+            age = now - float(info.get("updated") or info.get("built") or now)
+            lines = [
+                f"Root: {info.get('root', '?')}",
+                f"Entries: {int(info.get('entries') or 0):,}",
+                f"Size: {int(info.get('bytes') or 0) / 1e6:.1f} MB",
+                f"Updated: {self.format_age(age)} ago",
+            ]
+            if info.get("busy") == "1":
+                lines.append("Update in progress...")
+            info_label.config(text="\n".join(lines))
+
+        def failed(e):
+            if dlg.winfo_exists():
+                info_label.config(text=f"Index error: {e}")
+
+        def refresh():
+            self.engine.submit(lambda task: self.run_remote_command("fs_index_info"), show, failed)
+
+        def rebuild():
+            info_label.config(text="Rebuilding index (full scan of the home directory)...")
+            self.log_ai("System: Rebuilding host search index...")
+
+            def built(text):
+                self.log_ai("System: Search index rebuilt.")
+                show(text)
+
+            self.engine.submit(lambda task: self.run_remote_command("fs_index_build"), built, failed, key="index")
+
+        tk.Button(btn_frame, text="Rebuild", command=rebuild, bg=self.COLORS["accent"], fg="#121212", relief="flat", padx=10, pady=4).pack(side="left", padx=4)
+        tk.Button(btn_frame, text="Refresh", command=refresh, bg=self.COLORS["input"], fg=self.COLORS["fg"], relief="flat", padx=10, pady=4).pack(side="left", padx=4)
+        tk.Button(btn_frame, text="Close", command=dlg.destroy, bg=self.COLORS["input"], fg=self.COLORS["fg"], relief="flat", padx=10, pady=4).pack(side="right", padx=4)
+        refresh()
+
+    def open_fanout_dialog(self):
+        # Search several host profiles at once (selection kept for the AI's
+        # "all hosts" searches too)
+        dlg = tk.Toplevel(self)
+        dlg.title("Search Hosts")
+        dlg.configure(bg=self.COLORS["panel"])
+        dlg.resizable(False, False)
+
+        tk.Label(dlg, text="Search on:", bg=self.COLORS["panel"], fg=self.COLORS["fg"]).pack(anchor="w", padx=15, pady=(10, 0))
+        checks = {}
+        for name in self.settings:
+            var = tk.BooleanVar(value=not self.fanout_hosts or name in self.fanout_hosts)
+            tk.Checkbutton(dlg, text=name, variable=var, bg=self.COLORS["panel"], fg=self.COLORS["fg"], selectcolor=self.COLORS["input"], activebackground=self.COLORS["panel"]).pack(anchor="w", padx=25)
+            checks[name] = var
+        if not checks:
+            tk.Label(dlg, text="No host profiles configured.", bg=self.COLORS["panel"], fg=self.COLORS["fg_dim"]).pack(anchor="w", padx=25)
+
+        query_var = tk.StringVar()
+        entry = tk.Entry(dlg, textvariable=query_var, bg=self.COLORS["input"], fg=self.COLORS["fg"], insertbackground="white", relief="flat", width=40)
+        entry.pack(fill="x", padx=15, pady=10, ipady=4)
+        entry.focus_set()
+
+        def search(event=None):
+            query = query_var.get().strip()
+            selected = [name for name, var in checks.items() if var.get()]
+            if not query or not selected:
+                return
+            self.fanout_hosts = selected if len(selected) < len(checks) else []
+            dlg.destroy()
+            self.run_fanout_search(query, selected)
+
+        entry.bind("<Return>", search)
+        btn_frame = tk.Frame(dlg, bg=self.COLORS["panel"])
+        btn_frame.pack(fill="x", padx=10, pady=(0, 10))
+        tk.Button(btn_frame, text="Search", command=search, bg=self.COLORS["accent"], fg="#121212", relief="flat", padx=10, pady=4).pack(side="left", padx=4)
+        tk.Button(btn_frame, text="Close", command=dlg.destroy, bg=self.COLORS["input"], fg=self.COLORS["fg"], relief="flat", padx=10, pady=4).pack(side="right", padx=4)
+
+    @staticmethod
+    def format_age(seconds):
+        seconds = max(0, int(seconds))
+        for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+            if seconds >= size:
+                return f"{seconds // size}{unit}"
+        return f"{seconds}s"
+
+    def connect_ssh(self):
+        # Connect (or reuse the pooled connection) on a worker so the window
+        # stays responsive; the listing appears as soon as we're ready.
+        host_name = self.active_host_name
+        host_profile = self.get_active_host_profile()
+        target_key = self.resolve_key_path(host_profile)
+        self.path_label.config(text=f"Connecting to {host_name}...")
+
+        def work(task):
+            # Determine active host settings
+            task.progress(f"Connecting to {host_name}...")
+            # Only remote I/O here: the user may switch hosts meanwhile, so
+            # results are applied to this conn (and the explorer) in done()
+            conn = self.pool.get(host_name, host_profile, target_key, self.log_ai)
+            if task.cancelled:
+                return None
+            if conn.fs_context and conn.caps:
+                return conn, True, None, None
+
+            task.progress(f"Checking tools on {host_name}...")
+            probe = self.probe_host(lambda cmd: conn.run_raw(cmd).decode(errors="replace").strip())
+
+            # FS Overview for AI Context: last run's copy from disk if there
+            # is one; either way it is (re)built in the background once the
+            # first listing is up
+            return conn, False, probe, self.read_cache_file(host_name, ".overview")
+
+        def done(result):
+            if not result:
+                return
+            conn, warm, probe, overview = result
+            if probe:
+                caps, home = probe
+                conn.caps, conn.impl = caps, pick_impls(caps)
+                conn.home = home or conn.home
+                conn.fs_context = overview
+            self.bind_connection(conn)
+            if probe:
+                self.log_host_tools(conn.caps)
+            self.fs_context = conn.fs_context
+            pending, self.pending_hit = self.pending_hit, None
+            if warm:
+                # Warm switch: restore where we were on this host
+                self.current_path = conn.current_path
+                self.history_back = conn.history_back
+                self.history_fwd = conn.history_fwd
+                if pending:
+                    self.open_search_hit(pending)
+                else:
+                    self.refresh_files()
+                self.log_ai(f"System: Switched to '{host_name}' (pooled connection).")
+                return
+            self.mark_startup("connected")
+            if pending:
+                self.open_search_hit(pending)
+            else:
+                self.refresh_files()
+            self.refresh_overview()
+            self.log_ai("System: SSH Connected successfully.")
 
-    def connect_ssh(self):
-        try:
-            # Determine active host settings
-            host_profile = self.get_active_host_profile()
+        self.engine.submit(work, done, self.on_connect_failed, key="connect",
+                           on_progress=lambda text: self.path_label.config(text=text))
 
-            target_host = host_profile.get("host", HOST)
-            target_user = host_profile.get("user", USER)
-            target_key = self.resolve_key_path(host_profile)
+    def on_connect_failed(self, e):
+        # Fallback to Local Mode if SSH fails
+        response = messagebox.askyesno("Connection Failed", 
+            f"SSH Connection failed: {e}\n\nSwitch to Local Mode (no SSH)?")
+        if response:
+            self.enter_local_mode()
+        else:
+            self.destroy()
 
-            # Assumes SSH Key Auth. Use connect(password=...) if needed.
-            self.ssh.connect(target_host, username=target_user, key_filename=target_key)
-            self.sftp = self.ssh.open_sftp()
-            
-            # --- DEPLOY HOST FUNCTIONS ---
-            # Upload local host_functions.zsh to remote home as .host_functions.zsh
-            local_script = "host_functions.zsh"
-            remote_script = ".host_functions.zsh" # Hidden file in home
-            
-            if os.path.exists(local_script):
-                try:
-                    self.log_ai("System: Deploying host functions to remote...")
-                    self.sftp.put(local_script, remote_script)
-                except Exception as up_e:
-                    self.log_ai(f"Warning: Failed to deploy host_functions.zsh: {up_e}")
-            else:
-                self.log_ai("Warning: Local host_functions.zsh not found! Remote features may fail.")
+    def enter_local_mode(self):
+        self.use_local_mode = True
+        self.current_path = os.getcwd()
+        self.home = os.path.expanduser("~")
+        self.conn = None
+        self.ssh = self.sftp = self.agent = None
 
-            # Fetch FS Overview for AI Context
-            # We source the deployed script
-            self.fs_context = self.run_remote_command("fs_overview")
-            self.log_ai("System: File System Context Loaded.")
-            
+        def work(task):
+            agent = self.start_agent()
+            # Without the agent there is no zsh to ask; portable impls it is
+            probe = self.probe_host(agent.call) if agent else ({}, "")
+            # Local Overview (cached copy first, as for SSH hosts)
+            return agent, probe, self.read_cache_file("local", ".overview")
+
+        def done(result):
+            agent, (caps, home), fs_context = result
+            self.agent = agent
+            self.apply_caps(caps, home)
+            self.fs_context = fs_context
+            self.log_ai("System: Switched to Local Mode.")
             self.refresh_files()
-            self.log_ai("System: SSH Connected successfully.")
+            self.refresh_overview()
+
+        self.engine.submit(work, done, key="connect")
+
+    def start_agent(self):
+        # Bring up the resident local agent (SSH agents are owned by their
+        # HostConnection); without it we fall back to one subprocess per call.
+        try:
+            return HostAgent.local()
         except Exception as e:
-            # Fallback to Local Mode if SSH fails
-            response = messagebox.askyesno("Connection Failed", 
-                f"SSH Connection failed: {e}\n\nSwitch to Local Mode (no SSH)?")
-            if response:
-                self.use_local_mode = True
-                self.current_path = os.getcwd()
-                
-                # Fetch Local Overview
-                try:
-                    home = os.path.expanduser("~")
-                    # Emulate fs_overview locally with increased depth
-                    cmd = f"find {home} -maxdepth 10 -type d -not -path '*/.*' 2>/dev/null | head -n 500"
-                    self.fs_context = subprocess.getoutput(cmd)
-                except:
-                    self.fs_context = "[Local Overview Unavailable]"
-                
-                self.log_ai("System: Switched to Local Mode.")
-                self.refresh_files()
-            else:
-                self.destroy()
+            self.log_ai(f"Warning: Host agent unavailable, using per-call commands: {e}")
+            return None
 
     def run_remote_command(self, cmd):
         # Helper to run zsh functions
-        
-        if self.use_local_mode:
-            # Run locally via subprocess
-            # We construct a command that sources the script then runs the function
-            local_script_path = os.path.join(os.getcwd(), "host_functions.zsh")
-            full_cmd = f"zsh -c 'source {local_script_path}; {cmd}'"
+        return self.run_remote_raw(cmd).decode(errors="replace").strip()
+
+    def remote_conn(self):
+        # The connection being browsed; HostConnection reconnects it on use
+        conn = self.conn
+        if conn is None:
+            raise RuntimeError("Not connected")
+        return conn
+
+    def run_remote_raw(self, cmd):
+        # Same as run_remote_command but returns the untouched stdout bytes
+        if not self.use_local_mode:
+            return self.remote_conn().run_raw(cmd)
+        if self.agent and self.agent.alive:
             try:
-                result = subprocess.run(full_cmd, shell=True, capture_output=True, text=True)
-                return result.stdout.strip()
+                return self.agent.submit(cmd).read()
+            except AgentCancelled:
+                raise  # the caller gave up; don't re-run it another way
             except Exception as e:
-                return f"Error: {e}"
-        
-        # SSH Mode
-        # We use the deployed hidden file in home directory
-        remote_script_path = "~/.host_functions.zsh"
-        
-        # We need to source the file every time because the shell context might not persist fully in exec_command 
-        # unless we were using an invoke_shell shell. But for this simple request/response, sourcing is safer.
-        full_cmd = f"source {remote_script_path}; {cmd}"
-        stdin, stdout, stderr = self.ssh.exec_command(full_cmd)
-        return stdout.read().decode().strip()
+                self.log_ai(f"Warning: Host agent failed ({e}), using per-call commands.")
+                self.agent = None
+
+        # Run locally via subprocess
+        # We construct a command that sources the script then runs the function
+        full_cmd = "zsh -c " + shlex.quote(f"source {shlex.quote(LOCAL_SCRIPT)}; {cmd}")
+        try:
+            result = subprocess.run(full_cmd, shell=True, capture_output=True)
+            return result.stdout
+        except Exception as e:
+            return f"Error: {e}".encode()
+
+    def run_remote_stream(self, cmd):
+        # Generator of stdout chunks as they arrive (for long listings/searches)
+        if not self.use_local_mode:
+            yield from self.remote_conn().stream(cmd)
+            return
+        if self.agent and self.agent.alive:
+            call = self.agent.submit(cmd)
+            try:
+                yield from call.iter_chunks()
+            finally:
+                # Stop the host side too if the consumer gave up early
+                if not call.done.is_set():
+                    call.cancel()
+            return
+
+        task = current_task()
+        proc = subprocess.Popen(["zsh", "-c", f"source {shlex.quote(LOCAL_SCRIPT)}; {cmd}"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if task:
+            task.on_cancel(proc.kill)
+        try:
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
+    def run_remote_bulk(self, cmd):
+        # For large outputs: compress on the host when both ends can, which
+        # matters far more than CPU on slow links. Falls back to plain text.
+        if self.use_local_mode:
+            return self.run_remote_command(cmd)
+        if self.caps.get("zstd") and zstandard:
+            wrapped = f"{{ {cmd} }} | zstd -1 -c"
+            decompress = zstandard.ZstdDecompressor().decompressobj().decompress
+        elif self.caps.get("gzip"):
+            wrapped = f"{{ {cmd} }} | gzip -1 -c"
+            decompress = gzip.decompress
+        else:
+            return self.run_remote_command(cmd)
+        try:
+            return decompress(self.run_remote_raw(wrapped)).decode(errors="replace").strip()
+        except AgentCancelled:
+            raise
+        except Exception:
+            return self.run_remote_command(cmd)
+
+    def make_backend(self):
+        # Pick the filesystem backend for the current host (profile "backend")
+        if self.use_local_mode:
+            return LocalBackend()
+        # Built from the connection, not from explorer state: a queued
+        # prefetch that runs after a host switch still talks to its own host
+        conn = self.conn
+        shell = conn.shell_backend()
+        if conn.profile.get("backend", "auto") == "shell" or not conn.sftp:
+            return shell
+        # Bound to the connection, not to its current SFTP channel: a dropped
+        # link is re-opened by the next call instead of failing every listing
+        return SftpBackend(conn.live_sftp, shell)
 
     # --- FILE EXPLORER LOGIC ---
     
-    def refresh_files(self, path=None, clear_fwd=True):
+    def refresh_files(self, path=None, clear_fwd=True, on_loaded=None, force=False):
+        # force: list again even if the cached listing is fresh or its
+        # directory mtime is unchanged (the Refresh button)
         if path and path != self.current_path:
             # Standard navigation clears forward history
             if clear_fwd:
                 self.history_fwd.clear()
+            # Most recent last; prompt_focus puts these near the AI's focus
+            if self.current_path in self.history_back:
+                self.history_back.remove(self.current_path)
+            self.history_back.append(self.current_path)
+            del self.history_back[:-HISTORY_MAX]
             self.current_path = path
             
         self.path_label.config(text=self.current_path)
-        
-        # Clear tree
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        # Call Host Zsh Function
-        raw_data = self.run_remote_command(f"fs_list '{self.current_path}'")
-        
-        # Parse TYPE|NAME|SIZE
-        if raw_data:
-            for line in raw_data.split('\n'):
-                parts = line.split('|')
-                if len(parts) >= 2:
-                    ftype, fname, fsize = parts[0], parts[1], parts[2] if len(parts)>2 else "?"
-                    
-                    # No icons, just color coding tags
-                    if ftype == 'd':
-                        self.tree.insert("", "end", text=f" {fname}", values=(fsize), tags=('dir', fname))
-                    else:
-                        self.tree.insert("", "end", text=f" {fname}", values=(fsize), tags=('file', fname))
+        target = self.current_path
+        backend = self.backend
+        host = self.cache_host()
+        home = self.home
+
+        # Render a cached listing right away; fresh ones need no network at all
+        cached = self.listing_cache.get(host, target)
+        if cached:
+            self.file_view.set_entries(cached.entries, presorted=True)
+            self.mark_startup("first listing")
+            if on_loaded:
+                on_loaded()
+            self.prefetch_children(cached.entries)
+            if self.listing_cache.is_fresh(cached) and not force:
+                self.engine.cancel("listing")
+                return
+        else:
+            # Clear tree
+            self.file_view.set_entries([])
+
+        def work(task):
+            if cached and cached.dir_mtime is not None and not force:
+                # Revalidate: an unchanged directory mtime means unchanged entries
+                try:
+                    if backend.stat(target).mtime == cached.dir_mtime:
+                        self.listing_cache.touch(cached)
+                        return None
+                except Exception:
+                    pass
+            # Stream the listing; the first rows go out immediately, later
+            # ones are coalesced so the Tk thread sees a few batches a second
+            entries, batch, last_emit, dir_mtime = [], [], 0, None
+            for chunk, dir_mtime in backend.iter_list_dir(target):
+                if task.cancelled:
+                    return None
+                batch.extend(chunk)
+                now = time.monotonic()
+                if batch and not cached and (not entries or now - last_emit > 0.1):
+                    task.progress(batch)
+                    entries.extend(batch)
+                    batch, last_emit = [], now
+            if task.cancelled:
+                # A cancelled host call can end without another chunk; what
+                # we have is partial and must not be cached as the listing
+                return None
+            entries.extend(batch)
+            entries.sort(key=FileEntry.sort_key)
+            self.listing_cache.put(host, target, entries, dir_mtime)
+            self.path_index(host).update_dir(resolve_path(target, home), entries)
+            self.preview_cache.sync_dir(host, target, entries)
+            return entries
+
+        def progress(batch):
+            if target == self.current_path:
+                self.file_view.extend(batch)
+                self.path_label.config(text=f"{target}  ({self.file_view.count()} items...)")
+
+        def done(entries):
+            if entries is None or target != self.current_path:
+                return
+            self.path_label.config(text=target)
+            if cached:
+                # Background refresh: only redraw if something changed
+                if [(e.type, e.name, e.size) for e in entries] != [(e.type, e.name, e.size) for e in cached.entries]:
+                    self.file_view.set_entries(entries, keep_selection=True, presorted=True)
+                    self.prefetch_children(entries)
+                return
+            self.file_view.set_entries(entries, keep_selection=True, presorted=True)
+            self.mark_startup("first listing")
+            if on_loaded:
+                on_loaded()
+            self.prefetch_children(entries)
+
+        def failed(e):
+            self.path_label.config(text=target)
+            self.log_ai(f"Error: Could not list {target}: {e}")
+
+        # List through the host's filesystem backend, off the Tk thread.
+        # A newer listing supersedes this one if the user moves on.
+        self.engine.submit(work, done, failed, key="listing", on_progress=progress)
+
+    def cache_host(self):
+        return "local" if self.use_local_mode else self.active_host_name
+
+    def select_in_tree(self, target_name):
+        # Select a row by name and update the preview
+        return self.file_view.select_name(target_name)
 
     def on_double_click(self, event):
-        item_id = self.tree.selection()
-        if not item_id: return
-        item_id = item_id[0]
-        
-        # In Tkinter Treeview, item() returns a dictionary of options
-        item_dict = self.tree.item(item_id)
-        tags = item_dict.get("tags", [])
-        
-        # Tags is a list/tuple of strings. e.g. ['dir', 'MyFolder']
-        if 'dir' in tags:
-            # Find name. It is the second element in our logic: tags=('dir', fname)
-            if len(tags) >= 2:
-                dirname = tags[1]
-                new_path = os.path.join(self.current_path, dirname)
-                self.refresh_files(new_path)
+        entry = self.file_view.selected_entry()
+        if entry and entry.is_dir:
+            new_path = os.path.join(self.current_path, entry.name)
+            self.refresh_files(new_path)
 
     def go_back(self):
         # Hierarchical Back (Up to Parent)
@@ -606,29 +3425,19 @@ class RemoteExplorer(tk.Tk):
         # Alias for back
         self.go_back()
 
-    def on_single_select(self, event):
+    def on_single_select(self, entry=None):
         # Update Left Preview Pane
-        item_id = self.tree.selection()
-        if not item_id: return
-        item_id = item_id[0]
-        
-        item_dict = self.tree.item(item_id)
-        tags = item_dict.get("tags", [])
+        entry = entry or self.file_view.selected_entry()
         
         # Safety check
-        if not tags or len(tags) < 2: return
+        if not entry: return
         
-        ftype = tags[0] # 'dir' or 'file'
-        filename = tags[1]
+        ftype = 'dir' if entry.is_dir else 'file'
+        filename = entry.name
         
         # Get basic info
         full_path = os.path.join(self.current_path, filename)
-        
-        # Get file size
-        try:
-            file_size = item_dict.get("values", ["?"])[0]
-        except:
-            file_size = "?"
+        file_size = entry.size if entry.size is not None else "?"
         
         # Update Metadata Label ALWAYS
         # Use safe colors from palette
@@ -637,12 +3446,19 @@ class RemoteExplorer(tk.Tk):
         
         if ftype == 'file':
              meta_text = f"FILE: {filename}\nPATH: {full_path}\nSIZE: {file_size}"
-             self.meta_label.config(text=meta_text, fg=accent)
         else:
              meta_text = f"DIRECTORY: {filename}\nPATH: {full_path}"
-             self.meta_label.config(text=meta_text, fg=fg)
+        # Extra metadata comes with the listing, no further calls needed
+        if entry.mtime:
+             meta_text += f"\nMODIFIED: {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.mtime))}"
+        if entry.mode is not None:
+             meta_text += f"\nMODE: {entry.mode:o}"
+        if entry.target:
+             meta_text += f"\nLINK: -> {entry.target}"
+        self.meta_label.config(text=meta_text, fg=accent if ftype == 'file' else fg)
         
-        # Clear previous preview
+        # Clear previous preview; whatever the last row was loading is stale
+        self.cancel_preview()
         self.preview_text.delete(1.0, tk.END)
         for widget in self.frame_left.winfo_children():
             if isinstance(widget, tk.Label) and hasattr(widget, 'image'):
@@ -652,59 +3468,194 @@ class RemoteExplorer(tk.Tk):
 
         if ftype == 'file':
             ext = os.path.splitext(filename)[1].lower()
+            if not entry.is_file:
+                self.preview_text.insert(tk.END, "[No Preview - Not a Regular File]")
+                return
             
             # --- IMAGE PREVIEW ---
-            if ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp']:
+            if ext in IMAGE_EXTS:
                 if HAS_IMAGE_TK:
-                    self.show_image_preview(full_path)
+                    self.show_image_preview(full_path, self.preview_key(full_path, entry))
                 else:
                     self.preview_text.insert(tk.END, "[Image Preview Disabled - Missing PIL.ImageTk]")
                 return
 
             # --- TEXT/CODE PREVIEW ---
-            try:
-                if self.use_local_mode:
-                    with open(full_path, 'r', errors='ignore') as f:
-                         content = f.read(4096)
-                else:
-                    content = self.run_remote_command(f"head -n 50 '{full_path}'")
+            backend = self.backend
+            key = self.preview_key(full_path, entry)
+            # Prefetched (or seen before): no round trip at all
+            data = self.preview_cache.get(key, "text")
+            if data is not None:
+                self.preview_text.insert(tk.END, self.format_preview(data))
+                self.schedule_preview(lambda: self.prefetch_neighbours(entry))
+                return
+            self.preview_text.insert(tk.END, "[Loading preview...]")
 
+            def work(task):
+                data = backend.read_range(full_path, 0, PREVIEW_BYTES)
+                if not task.cancelled and self.preview_complete(data, entry.size):
+                    self.preview_cache.put(key, "text", data)
+                return self.format_preview(data)
+
+            def done(content):
+                self.preview_text.delete(1.0, tk.END)
                 self.preview_text.insert(tk.END, content)
-            except Exception as e:
+
+            def failed(e):
+                self.preview_text.delete(1.0, tk.END)
                 self.preview_text.insert(tk.END, f"[Binary/Unreadable File]\nError: {e}")
 
+            def start():
+                self.engine.submit(work, done, failed, key="preview")
+                self.prefetch_neighbours(entry)
+
+            self.schedule_preview(start)
+
         else:
             self.preview_text.insert(tk.END, "[Directory Selected]")
+            # Most likely next step is opening it
+            self.schedule_preview(lambda: self.prefetch_listing(full_path, priority=0))
 
-    def show_image_preview(self, path):
-        try:
-            # Hide text widget
-            self.preview_text.pack_forget()
-            
-            # Load Image
-            if self.use_local_mode:
-                img_data = Image.open(path)
-            else:
-                # Remote image: download to memory buffer
-                with self.sftp.open(path, 'rb') as f:
-                    img_bytes = f.read()
-                img_data = Image.open(io.BytesIO(img_bytes))
-            
-            # Resize thumbnail
-            img_data.thumbnail((300, 300))
-            photo = ImageTk.PhotoImage(img_data)
-            
-            lbl = tk.Label(self.frame_left, image=photo, bg=self.COLORS["panel"])
-            lbl.image = photo # Keep reference
-            lbl.pack(expand=True, padx=5, pady=5)
-            
-        except Exception as e:
+    def schedule_preview(self, start):
+        # Metadata is already shown; content is fetched only once the
+        # selection rests, so holding an arrow key costs no round trips
+        self.cancel_preview()
+        self.preview_timer = self.after(PREVIEW_DEBOUNCE_MS, self._start_preview, start)
+
+    def _start_preview(self, start):
+        self.preview_timer = None
+        start()
+
+    def cancel_preview(self):
+        if self.preview_timer:
+            self.after_cancel(self.preview_timer)
+            self.preview_timer = None
+        self.engine.cancel("preview")
+
+    @staticmethod
+    def preview_complete(data, size):
+        # A read shorter than the file allows means the call failed part way
+        # (a shell read of an unreadable file comes back empty); show it,
+        # but never cache it
+        return size is None or len(data) >= min(size, PREVIEW_BYTES)
+
+    def format_preview(self, data):
+        return "\n".join(data.decode(errors="ignore").split("\n")[:PREVIEW_LINES])
+
+    def preview_key(self, path, entry):
+        # Size and mtime in the key: a changed file never hits a stale preview
+        return (self.cache_host(), path, entry.size, entry.mtime)
+
+    # --- PREFETCH ---
+    def prefetch_children(self, entries):
+        # After a listing: warm the most recently modified subdirectories
+        host = self.cache_host()
+        self.prefetcher.clear(host)
+        subdirs = sorted((e for e in entries if e.is_dir), key=lambda e: e.mtime or 0, reverse=True)
+        for rank, e in enumerate(subdirs[:PREFETCH_MAX_DIRS]):
+            self.prefetch_listing(os.path.join(self.current_path, e.name), priority=10 + rank)
+
+    def prefetch_listing(self, path, priority):
+        host, backend, cache = self.cache_host(), self.backend, self.listing_cache
+        cached = cache.get(host, path)
+        if cached and cache.is_fresh(cached):
+            return
+
+        def fetch():
+            entries, dir_mtime = backend.list_dir(path)
+            cache.put(host, path, entries, dir_mtime)
+
+        self.prefetcher.schedule(host, path, fetch, priority)
+
+    def prefetch_preview(self, entry, priority):
+        if not entry.is_file or os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+            return
+        path = os.path.join(self.current_path, entry.name)
+        key = self.preview_key(path, entry)
+        if self.preview_cache.contains(key, "text"):
+            return
+        backend, cache = self.backend, self.preview_cache
+
+        def fetch():
+            data = backend.read_range(path, 0, PREVIEW_BYTES)
+            if self.preview_complete(data, entry.size):
+                cache.put(key, "text", data)
+
+        self.prefetcher.schedule(self.cache_host(), path, fetch, priority)
+
+    def prefetch_neighbours(self, entry):
+        # Keyboard browsing moves one row at a time
+        for neighbour in self.file_view.neighbours(entry):
+            self.prefetch_preview(neighbour, priority=1)
+
+    def on_tree_hover(self, event):
+        entry = self.file_view.entry_at(event.y)
+        if entry is None or entry is self.hovered_entry:
+            return
+        self.hovered_entry = entry
+        if entry.is_dir:
+            self.prefetch_listing(os.path.join(self.current_path, entry.name), priority=1)
+        elif entry.is_file:
+            self.prefetch_preview(entry, priority=2)
+
+    def show_image_preview(self, path, key):
+        # Hide text widget
+        self.preview_text.pack_forget()
+        backend = self.backend
+        local = self.use_local_mode
+        cache = self.preview_cache
+
+        # Thumbnails are cached as small PNGs; re-selecting decodes one locally
+        thumb = cache.get(key, "thumb")
+        if thumb is not None:
+            self.show_thumbnail(thumb)
+            return
+
+        size = key[2]
+
+        def work(task):
+            # Bounded fetch and decode on the worker: a host-made thumbnail
+            # (a few KB) when the host has a tool, else a capped ranged read
+            if load_pil()[1] is None:
+                raise RuntimeError("Image Preview Disabled - Missing PIL.ImageTk")
+            thumb = None
+            if not local and (size is None or size > IMAGE_HEAD_BYTES):
+                thumb = backend.thumbnail(path, max(THUMB_SIZE))
+                if thumb is not None:
+                    try:
+                        load_pil()[0].open(io.BytesIO(thumb)).load()
+                    except Exception:
+                        thumb = None  # cut short or garbled; decode it here instead
+            if thumb is None:
+                thumb = make_thumbnail(lambda offset, length: backend.read_range(path, offset, length), size)
+            if not task.cancelled:
+                cache.put(key, "thumb", thumb)
+            return thumb
+
+        def done(thumb):
+            self.show_thumbnail(thumb)
+
+        def failed(e):
             self.preview_text.pack(expand=True, fill="both")
             self.preview_text.insert(tk.END, f"[Image Preview Failed: {e}]")
 
+        self.schedule_preview(lambda: self.engine.submit(work, done, failed, key="preview"))
+
+    def show_thumbnail(self, png):
+        Image, ImageTk, _ = load_pil()
+        photo = ImageTk.PhotoImage(Image.open(io.BytesIO(png)))
+        
+        lbl = tk.Label(self.frame_left, image=photo, bg=self.COLORS["panel"])
+        lbl.image = photo # Keep reference
+        lbl.pack(expand=True, padx=5, pady=5)
+
     # --- AI & LOGIC ---
 
     def log_ai(self, text):
+        if threading.current_thread() is not threading.main_thread():
+            # Workers log through the engine; Tk is only touched on its thread
+            self.engine.call_soon(self.log_ai, text)
+            return
         self.chat_history.config(state='normal')
         self.chat_history.insert(tk.END, text + "\n\n")
         self.chat_history.see(tk.END)
@@ -715,14 +3666,47 @@ class RemoteExplorer(tk.Tk):
         if not user_input: return
         self.prompt_entry.delete(0, tk.END)
         self.log_ai(f"You: {user_input}")
-        
-        # Start Loading Animation
-        self.start_loading_animation()
-        
-        # Run AI in background thread to avoid freezing UI
-        threading.Thread(target=self.run_ai_thread, args=(user_input,), daemon=True).start()
+
+        # Plain navigation/search commands are handled here, no API call
+        subdirs = [e.name for e in self.file_view.entries if e.is_dir]
+        intent = local_intent(user_input, self.current_path, subdirs,
+                              lambda name: self.context_builder.dirs_named(self.fs_context, name))
+        if intent and not self.ai_scheduler.pending():
+            self.execute_ai_action(intent)
+            return
+
+        if intent:
+            # AI commands typed earlier are still out: queue behind them, or
+            # their replies would land after this and move the view again
+            fn = lambda task: ("local", intent)
+        else:
+            # Start Loading Animation
+            self.start_loading_animation()
+            # Tk thread: read explorer state here, not in the worker
+            focus, budget = self.prompt_focus()
+            fn = lambda task: self.ai_request(user_input, task, focus, budget)
+
+        # Queue the request; the scheduler runs it off the Tk thread and
+        # applies replies in the order the commands were typed
+        _, superseded = self.ai_scheduler.submit(fn, self.apply_ai_result, self.on_ai_error)
+        if superseded:
+            self.log_ai(f"System: Skipped {len(superseded)} queued command(s) superseded by this one.")
+
+    def cancel_ai_commands(self, event=None):
+        if self.ai_scheduler.pending():
+            self.ai_scheduler.cancel_all()
+            self.log_ai("System: AI commands cancelled.")
+
+    def on_ai_retry(self, task, attempt, delay, exc):
+        self.log_ai(f"System: AI request failed ({exc}); retry {attempt}/{AI_RETRIES} in {delay:.1f}s.")
+
+    def on_ai_error(self, e):
+        self.update_ai_stats()
+        self.log_ai(f"Error: {e}")
 
     def start_loading_animation(self):
+        if self.is_loading:
+            return
         self.is_loading = True
         self.spinner_canvas.pack(pady=5) # Show canvas
         self.animate_spinner()
@@ -754,57 +3738,127 @@ class RemoteExplorer(tk.Tk):
         if hasattr(self, 'loading_anim_id'):
              self.after_cancel(self.loading_anim_id)
 
-    def run_ai_thread(self, user_input):
-        # Construct Prompt for OpenAI
-        # We tell GPT to output JSON so we can execute code programmatically
-        system_prompt = f"""
-        You are a file manager assistant. 
-        
+    def ai_request(self, user_input, task, focus, budget):
+        # Runs on an AI scheduler worker; returns what apply_ai_result needs.
+        # focus and budget were read on the Tk thread (prompt_focus).
+        # Construct Prompt for OpenAI. Stable text first (instructions, the
+        # host list and the top of this host's tree), per-request context
+        # after it, so the provider can cache the shared prefix; the current
+        # path changes most, so it's last.
+        host_name = self.active_host_name
+        stable_prompt = "\n".join([
+            AI_INSTRUCTIONS,
+            f"Configured hosts: {', '.join(self.settings) or 'none'}",
+            f"Top of the file system on '{host_name}' (directory tree, one space of indent per level, "
+            f'"a/b/" = b inside a, ~ = home; partial):',
+            self.context_builder.outline(self.fs_context),
+        ])
+        context = self.context_builder.build(self.fs_context, user_input, focus, budget)
+        context_prompt = f"""
         CONTEXT:
+        Directories relevant to this request (same tree format; partial):
+        {context}
+        Current Host: '{host_name}'
         Current Path: '{self.current_path}'
-        File System Overview:
-        {self.fs_context}
-        
-        Interpret the user request. Use the Overview to infer paths.
-        
-        Return ONLY a valid JSON object. Do not add markdown formatting.
-        
-        Possible actions:
-        1. "search": finds a file. Params: "query".
-        2. "copy": copies a file. Params: "source", "destination", "direction" (to_host or to_client).
-        3. "navigate": changes directory. Params: "path".
-        4. "question": ask the user for clarification. Params: "text".
-        
-        Example: {{"action": "search", "params": {{"query": "tax_report"}} }}
-        Example: {{"action": "question", "params": {{"text": "Did you mean the 2023 or 2024 report?"}} }}
         """
 
-        try:
-            response = self.ai_client.chat.completions.create(
-                model="gpt-5-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ]
-            )
-            ai_reply = response.choices[0].message.content
-            
-            # Schedule execution on main thread
-            self.after(0, lambda: self.handle_ai_response(ai_reply))
-            
-        except Exception as e:
-            self.after(0, lambda: self.stop_loading_animation())
-            self.after(0, lambda: self.log_ai(f"Error: {e}"))
+        # Same command from the same directory against the same relevant
+        # directories: reuse the answer (replies can be relative to where
+        # the user is, so the current path is always part of the key)
+        relevant = self.context_builder.relevant(self.fs_context, user_input)
+        cache_key = self.ai_cache.key(self.cache_host(), user_input,
+                                      "\n".join([self.current_path] + relevant))
+        cached = self.ai_cache.get(cache_key)
+        if cached:
+            return ("cached", cached)
+
+        response = self.get_ai_client().chat.completions.create(
+            model="gpt-5-mini",
+            messages=[
+                {"role": "system", "content": stable_prompt},
+                {"role": "system", "content": context_prompt},
+                {"role": "user", "content": user_input}
+            ],
+            stream=True
+        )
+        # Fields are handed to the main thread as they complete, so the
+        # action's I/O overlaps the rest of the generation
+        stream, early, parts = ActionStream(), {}, []
+        for chunk in response:
+            if task.cancelled:
+                response.close()  # stop paying for tokens nobody will read
+                return None
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            done = stream.feed(delta)
+            if done:
+                self.engine.call_soon(self.dispatch_early, task, early, dict(stream.fields), done)
+        return ("reply", "".join(parts), cache_key, early)
 
-    def handle_ai_response(self, ai_reply):
-        self.stop_loading_animation()
+    def apply_ai_result(self, result):
+        if result is None:
+            return
+        if result[0] == "local":
+            self.execute_ai_action(result[1])
+        elif result[0] == "cached":
+            self.handle_cached_action(result[1])
+        else:
+            self.handle_ai_response(*result[1:])
+
+    def dispatch_early(self, task, early, fields, done):
+        # Start what a partial reply already pins down. navigate only warms
+        # the listing; search/grep start for real and the final reply skips
+        # them if it matches what was started. Only the oldest unapplied
+        # request may do this, or it could overtake an earlier command.
+        if task.cancelled or not self.ai_scheduler.is_next(task):
+            return
+        action = fields.get("action")
+        params = ActionStream.params(fields)
+        if action == "navigate" and "params.path" in done:
+            self.prefetch_listing(resolve_path(params["path"], self.home), priority=0)
+        elif action == "search" and "params.query" in done:
+            # A "hosts" field may still follow; the final reply then
+            # supersedes this with a fan-out search
+            self.run_search(params["query"])
+            early["started"] = {"action": action, "params": {"query": params["query"]}}
+        elif action == "grep" and "params" in done and params.get("pattern"):
+            self.run_grep(params["pattern"], params.get("path"), bool(params.get("regex")))
+            early["started"] = {"action": action, "params": params}
+
+    def handle_ai_response(self, ai_reply, cache_key=None, early=None):
+        self.update_ai_stats()
         try:
             action_data = json.loads(ai_reply)
+        except Exception as e:
+            self.log_ai(f"Error parsing AI response: {e}\nRaw: {ai_reply}")
+            return
+        if cache_key and isinstance(action_data, dict) and action_data.get("action") in AI_CACHEABLE_ACTIONS:
+            self.ai_cache.put(cache_key, action_data)
+        if early and early.get("started") == action_data:
+            return  # already running since the field streamed in
+        try:
             self.execute_ai_action(action_data)
         except Exception as e:
             self.log_ai(f"Error parsing AI response: {e}\nRaw: {ai_reply}")
 
+    def handle_cached_action(self, action_data):
+        self.update_ai_stats()
+        self.log_ai("AI: (cached answer)")
+        self.execute_ai_action(action_data)
+
+    def update_ai_stats(self):
+        self.ai_stats_label.config(text=self.ai_cache.stats())
+
     def execute_ai_action(self, data):
+        if "plan" in data:
+            if not isinstance(data["plan"], list) or not data["plan"]:
+                self.log_ai("System: The AI's plan is invalid; nothing was run.")
+                return
+            self.log_ai(f"AI: Running a {len(data['plan'])}-step plan...")
+            PlanExecutor(data["plan"], self.run_plan_step, self.log_ai).start()
+            return
         action = data.get("action")
         params = data.get("params")
 
@@ -819,184 +3873,608 @@ class RemoteExplorer(tk.Tk):
             self.prompt_entry.focus_set()
             return
 
-        if action == "navigate":
-            self.refresh_files(params["path"])
+        if action == "up":
+            self.go_up()
+        elif action == "forward":
+            self.go_fwd()
+
+        elif action == "navigate":
+            # The overview spells home as ~, which no backend expands
+            self.refresh_files(resolve_path(params["path"], self.home))
             self.log_ai(f"AI: Navigated to {params['path']}")
 
         elif action == "search":
-            self.log_ai(f"AI: Searching for '{params['query']}'...")
-            
-            # Use host zsh search with error capturing
-            # Note: We use "." as search path if current path is root-like or empty
-            search_base = self.current_path if self.current_path else "."
-            
-            # Debug:
-            # self.log_ai(f"Debug: find '{search_base}' -name '*{params['query']}*'")
-            
-            results = self.run_remote_command(f"fs_search '{params['query']}' '{search_base}'")
-            
-            if not results:
-                 self.log_ai("AI: No results found in current directory. Trying Home directory...")
-                 home_path = os.path.expanduser("~")
-                 results = self.run_remote_command(f"fs_search '{params['query']}' '{home_path}'")
-                 
-                 if not results:
-                     self.log_ai("AI: No results found in Home directory either.")
-                 else:
-                     self.log_ai(f"Results (from Home):\n{results}")
-
+            hosts = params.get("hosts")
+            if hosts:
+                self.run_fanout_search(params['query'], None if hosts == "all" else hosts)
             else:
-                 self.log_ai(f"Results:\n{results}")
-            
-            # Logic: If result found, parse valid paths
-            if results and "|" in results:
-                # Format: TYPE|PATH|SIZE
-                lines = results.strip().split('\n')
-                if lines:
-                     # Just grab the first valid match
-                     first_match_parts = lines[0].split('|')
-                     if len(first_match_parts) >= 2:
-                         full_path = first_match_parts[1]
-                         parent_dir = os.path.dirname(full_path)
-                         
-                         self.log_ai(f"AI: Found match at {full_path}")
-                         self.log_ai(f"AI: Navigating to context: {parent_dir}")
-                         
-                         # Navigate to the directory containing the file
-                         self.refresh_files(parent_dir)
-                         
-                         # Select the file in the tree
-                         target_name = os.path.basename(full_path)
-                         for item in self.tree.get_children():
-                             item_text = self.tree.item(item, "text")
-                             # Text includes icon, so check tags or end of string
-                             tags = self.tree.item(item, "tags")
-                             if tags and len(tags) >= 2 and tags[1] == target_name:
-                                 self.tree.selection_set(item)
-                                 self.tree.focus(item)
-                                 self.tree.see(item)
-                                 # Trigger selection event manually to update preview
-                                 self.on_single_select(None)
-                                 break
+                self.run_search(params['query'])
             
+        elif action == "grep":
+            self.run_grep(params['pattern'], params.get('path'), bool(params.get('regex')))
+
         elif action == "copy":
             src = params.get("source")
             dest = params.get("destination")
             direction = params.get("direction")
+            if self.confirm_copy(src, dest):
+                self.perform_copy(src, dest, direction)
+
+    def confirm_copy(self, src, dest):
+        # --- DOUBLE PERMISSION LOGIC ---
+        confirm1 = messagebox.askyesno("Permission Request 1/2", 
+            f"AI wants to copy:\n{src} -> {dest}\n\nAllow initial access?")
+        
+        if confirm1:
+            confirm2 = messagebox.askwarning("Final Authorization 2/2", 
+                "Confirming Write Operation.\nThis action is irreversible.\nProceed?")
             
-            # --- DOUBLE PERMISSION LOGIC ---
-            confirm1 = messagebox.askyesno("Permission Request 1/2", 
-                f"AI wants to copy:\n{src} -> {dest}\n\nAllow initial access?")
-            
-            if confirm1:
-                confirm2 = messagebox.askwarning("Final Authorization 2/2", 
-                    "Confirming Write Operation.\nThis action is irreversible.\nProceed?")
-                
-                if confirm2:
-                    self.perform_copy(src, dest, direction)
-                else:
-                    self.log_ai("System: Copy Aborted at stage 2.")
+            if confirm2:
+                return True
+            self.log_ai("System: Copy Aborted at stage 2.")
+        else:
+            self.log_ai("System: Copy Aborted at stage 1.")
+        return False
+
+    def run_plan_step(self, action, params, on_done):
+        # One step of an AI plan; on_done gets the path the step produced
+        if action == "navigate":
+            path = resolve_path(params["path"], self.home)
+            self.refresh_files(path)
+            self.log_ai(f"AI: Navigated to {params['path']}")
+            on_done(path)
+        elif action == "search":
+            self.run_search(params["query"], on_done=on_done)
+        elif action == "grep":
+            self.run_grep(params["pattern"], params.get("path"), bool(params.get("regex")), on_done=on_done)
+        elif action == "copy":
+            src, dest = params.get("source"), params.get("destination")
+            if self.confirm_copy(src, dest):
+                self.perform_copy(src, dest, params.get("direction"), on_done=on_done)
             else:
-                self.log_ai("System: Copy Aborted at stage 1.")
+                on_done(None)
+        else:
+            if action == "question":
+                self.log_ai(f"AI: {params.get('text')}")
+                self.prompt_entry.focus_set()
+            else:
+                self.log_ai(f"System: Unknown plan action {action!r}.")
+            on_done(None)
+
+    def run_search(self, query, on_done=None):
+        # on_done(path): the best hit's full path, or None (AI plans; the hit
+        # is then left to the plan rather than opened)
+        self.log_ai(f"AI: Searching for '{query}'...")
+        host, home = self.cache_host(), self.home
+        index = self.path_index(host)
+        self.show_search_panel(query)
+
+        # Paths we already know about answer instantly; only go to the host
+        # when none of them actually matches the name
+        local = index.query(query)
+        if index.confident(query, local):
+            self.add_search_hits([(host, FileEntry(ftype, path)) for _, path, ftype in local])
+            self.finish_search(f"{len(self.search_hits)} known paths", "Results (known paths)", auto_open=not on_done)
+            if on_done:
+                on_done(resolve_path(self.search_hits[0][1].name, home))
+            return
+
+        # Use host zsh search with error capturing
+        # Note: We use "." as search path if current path is root-like or empty
+        search_base = self.current_path if self.current_path else "."
+        backend = self.backend
+        deadline = time.monotonic() + SEARCH_TIME_BUDGET
+        bases = [search_base]
+        if resolve_path(search_base, home) != posixpath.normpath(home):
+            bases.append(home)
+
+        def work(task):
+            # Hits stream into the panel as the host finds them; the search
+            # stops at the time budget or when the user cancels. The timer
+            # stops the host call even while find walks without a hit.
+            found, from_home = 0, False
+            timer = task.interrupt_after(deadline - time.monotonic())
+            try:
+                for base in bases:
+                    for batch in backend.iter_search(query, base, SEARCH_MAX_RESULTS):
+                        if task.cancelled:
+                            return None
+                        if batch:
+                            found += len(batch)
+                            index.add_many((resolve_path(e.name, home), e.type) for e in batch)
+                            task.progress(batch)
+                        if time.monotonic() > deadline:
+                            return found, from_home, True
+                    if time.monotonic() > deadline:
+                        return found, from_home, True  # call cut short by the timer
+                    if found or task.cancelled or base is bases[-1]:
+                        break
+                    self.log_ai("AI: No results found in current directory. Trying Home directory...")
+                    from_home = True
+            except AgentCancelled:
+                if task.cancelled:
+                    return None
+                return found, from_home, True
+            finally:
+                timer.cancel()
+            return found, from_home, False
+
+        def done(outcome):
+            if outcome is None:
+                return
+            found, from_home, timed_out = outcome
+            if not found:
+                self.search_status.config(text=f"No results for '{query}'")
+                self.search_cancel_btn.state(["disabled"])
+                self.log_ai("AI: No results found in Home directory either.")
+                if on_done:
+                    on_done(None)
+                return
+            status = f"{len(self.search_hits)} results" + (" (time budget reached)" if timed_out else "")
+            self.finish_search(status, "Results (from Home)" if from_home else "Results", auto_open=not on_done)
+            if on_done:
+                on_done(resolve_path(self.search_hits[0][1].name, home))
+
+        def failed(e):
+            self.search_status.config(text="Search failed")
+            self.search_cancel_btn.state(["disabled"])
+            self.log_ai(f"Search Failed: {e}")
+            if on_done:
+                on_done(None)
+
+        self.engine.submit(work, done, failed, key="search",
+                           on_progress=lambda batch: self.add_search_hits([(host, e) for e in batch]))
+
+    def run_fanout_search(self, query, hosts=None):
+        # The same search on several host profiles at once. Every host gets
+        # its own connection (pooled), streams into the shared panel and has
+        # SEARCH_HOST_TIMEOUT seconds, so a slow box doesn't hold up the rest.
+        names = [n for n in (hosts or self.fanout_hosts or list(self.settings)) if n in self.settings]
+        if not names:
+            self.log_ai("AI: No host profiles to search.")
+            return
+        self.log_ai(f"AI: Searching for '{query}' on {len(names)} hosts ({', '.join(names)})...")
+        self.show_search_panel(query, multi=True)
+        jobs = [(n, self.settings[n], self.resolve_key_path(self.settings[n])) for n in names]
+
+        def search_host(sub, name, profile, key_path, results):
+            # Runs on its own thread; agent calls made here die with sub
+            _task_local.task = sub
+            try:
+                conn = self.pool.get(name, profile, key_path, lambda msg: None, activate=False)
+                conn.prepare()
+                index = self.path_index(name)
+                for batch in conn.shell_backend().iter_search(query, conn.home, SEARCH_MAX_RESULTS):
+                    if sub.cancelled:
+                        return
+                    if batch:
+                        index.add_many((resolve_path(e.name, conn.home), e.type) for e in batch)
+                        results.put((name, batch))
+                results.put((name, None))
+            except Exception as e:
+                results.put((name, e))
+            finally:
+                _task_local.task = None
+
+        def work(task):
+            results, subs, counts = queue.Queue(), {}, {}
+            for name, profile, key_path in jobs:
+                sub = subs[name] = Task(None)
+                task.on_cancel(sub.cancel)
+                counts[name] = 0
+                threading.Thread(target=search_host, args=(sub, name, profile, key_path, results), daemon=True).start()
+            deadline = time.monotonic() + SEARCH_HOST_TIMEOUT
+            pending, outcome = set(subs), {}
+            while pending and not task.cancelled:
+                try:
+                    name, item = results.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if name not in pending:
+                    continue
+                if item is None or isinstance(item, Exception):
+                    pending.discard(name)
+                    outcome[name] = item or counts[name]
+                else:
+                    counts[name] += len(item)
+                    task.progress([(name, e) for e in item])
+            for name in pending:
+                subs[name].cancel()
+                outcome[name] = "timed out"
+            return None if task.cancelled else outcome
+
+        def done(outcome):
+            if outcome is None:
+                return
+            summary = "\n".join(f"  {name}: {res if not isinstance(res, int) else f'{res} hits'}"
+                                for name, res in outcome.items())
+            self.log_ai(f"Hosts:\n{summary}")
+            if not self.search_hits:
+                self.search_status.config(text=f"No results for '{query}' on {len(names)} hosts")
+                self.search_cancel_btn.state(["disabled"])
+                return
+            self.finish_search(f"{len(self.search_hits)} results on {len(names)} hosts", "Results", auto_open=False)
+
+        def failed(e):
+            self.search_status.config(text="Search failed")
+            self.search_cancel_btn.state(["disabled"])
+            self.log_ai(f"Search Failed: {e}")
+
+        self.engine.submit(work, done, failed, key="search", on_progress=self.add_search_hits)
+
+    def run_grep(self, pattern, path=None, regex=False, on_done=None):
+        # Content search on the host; only matching lines come back, streamed
+        # into the results panel as "file:line  text"
+        host, home = self.cache_host(), self.home
+        base = resolve_path(path, home) if path else (self.current_path or ".")
+        backend = self.backend
+        self.log_ai(f"AI: Searching file contents for '{pattern}' in {base}...")
+        self.show_search_panel(pattern)
+        deadline = time.monotonic() + SEARCH_TIME_BUDGET
+
+        def work(task):
+            found = 0
+            timer = task.interrupt_after(deadline - time.monotonic())
+            try:
+                for batch in backend.iter_grep(pattern, base, GREP_MAX_MATCHES, regex):
+                    if task.cancelled:
+                        return None
+                    if batch:
+                        found += len(batch)
+                        task.progress(batch)
+                    if time.monotonic() > deadline:
+                        return found, True
+            except AgentCancelled:
+                if task.cancelled:
+                    return None
+                return found, True
+            finally:
+                timer.cancel()
+            return found, time.monotonic() > deadline
+
+        def done(outcome):
+            if outcome is None:
+                return
+            found, timed_out = outcome
+            self.search_cancel_btn.state(["disabled"])
+            if not found:
+                self.search_status.config(text=f"No matches for '{pattern}'")
+                self.log_ai("AI: No matching lines found.")
+                if on_done:
+                    on_done(None)
+                return
+            limit_note = " (limit reached)" if found >= GREP_MAX_MATCHES else ""
+            self.search_status.config(text=f"{found} matching lines" + (" (time budget reached)" if timed_out else limit_note))
+            lines = "\n".join(f"{e.name}:{num}: {text.strip()[:120]}" for (_, e), (num, text) in zip(self.search_hits[:10], self.grep_lines))
+            self.log_ai(f"Matches:\n{lines}")
+            if not self.search_opened and not on_done:
+                self.open_search_hit(self.search_hits[0][1].name)
+            if on_done:
+                on_done(resolve_path(self.search_hits[0][1].name, home))
 
-    def perform_copy(self, src, dest, direction):
+        def failed(e):
+            self.search_status.config(text="Content search failed")
+            self.search_cancel_btn.state(["disabled"])
+            if on_done:
+                on_done(None)
+            self.log_ai(f"Grep Failed: {e}")
+
+        self.engine.submit(work, done, failed, key="search",
+                           on_progress=lambda batch: self.add_grep_hits(host, batch))
+
+    def add_grep_hits(self, host, batch):
+        # Matches stay in the order the host reports them (no re-ranking)
+        for path, num, text in batch:
+            i = len(self.search_hits)
+            self.search_hits.append((host, FileEntry("f", path)))
+            self.grep_lines.append((num, text))
+            if i < 500:
+                self.search_tree.insert("", "end", iid=str(i), text=f"  {posixpath.basename(path)}:{num}", values=(text.strip()[:200],), tags=("file",))
+        if self.search_cancel_btn.instate(["!disabled"]):
+            self.search_status.config(text=f"Searching contents for '{self.search_query}'... {len(self.search_hits)} lines")
+
+    def show_search_panel(self, query, multi=False):
+        self.search_query = query
+        self.search_hits = []
+        self.grep_lines = []
+        self.search_multi = multi
+        self.search_opened = False
+        self.search_tree.delete(*self.search_tree.get_children())
+        self.search_status.config(text=f"Searching '{query}'...")
+        self.search_cancel_btn.state(["!disabled"])
+        self.search_frame.grid()
+
+    def add_search_hits(self, batch):
+        # Merge a batch of (host, entry) and re-rank; only the top rows are drawn
+        known = {(host, e.name) for host, e in self.search_hits}
+        self.search_hits.extend(hit for hit in batch if (hit[0], hit[1].name) not in known)
+        now = time.time()
+        self.search_hits.sort(key=lambda hit: -search_rank(self.search_query, hit[1], now))
+        self.search_tree.delete(*self.search_tree.get_children())
+        for i, (host, e) in enumerate(self.search_hits[:200]):
+            name = posixpath.basename(e.name.rstrip("/")) or e.name
+            where = posixpath.dirname(e.name)
+            if self.search_multi:
+                where = f"{host}: {where}"
+            tag = "dir" if e.is_dir else "file"
+            self.search_tree.insert("", "end", iid=str(i), text=f"  {name}", values=(where,), tags=(tag,))
+        if self.search_cancel_btn.instate(["!disabled"]):
+            self.search_status.config(text=f"Searching '{self.search_query}'... {len(self.search_hits)} found")
+
+    def finish_search(self, status, label, auto_open=True):
+        self.search_status.config(text=status)
+        self.search_cancel_btn.state(["disabled"])
+        top = self.search_hits[:10]
+        if self.search_multi:
+            listing = "\n".join(f"{host}: {line}" for (host, _), line in zip(top, self.format_results([e for _, e in top]).splitlines()))
+        else:
+            listing = self.format_results([e for _, e in top])
+        self.log_ai(f"{label}:\n{listing}")
+        if auto_open and not self.search_opened:
+            self.open_search_hit(self.search_hits[0][1].name)
+
+    def cancel_search(self):
+        self.engine.cancel("search")
+        self.search_cancel_btn.state(["disabled"])
+        self.search_status.config(text=f"Stopped: {len(self.search_hits)} results")
+
+    def close_search_panel(self):
+        self.cancel_search()
+        self.search_frame.grid_remove()
+
+    def on_search_hit_open(self, event=None):
+        sel = self.search_tree.selection()
+        if not sel:
+            return
+        self.search_opened = True
+        host, entry = self.search_hits[int(sel[0])]
+        self.open_search_hit(entry.name, host)
+
+    def open_search_hit(self, full_path, host=None):
+        if host and host != self.cache_host():
+            # Hit on another host: switch to it, then open the hit there
+            self.log_ai(f"AI: Switching to '{host}' for {full_path}")
+            self.pending_hit = full_path
+            self.host_var.set(host)
+            self.on_host_change(keep_search=True)
+            return
+        parent_dir = os.path.dirname(full_path)
+
+        self.log_ai(f"AI: Found match at {full_path}")
+        self.log_ai(f"AI: Navigating to context: {parent_dir}")
+
+        # Navigate to the directory containing the file, then select it
+        target_name = os.path.basename(full_path)
+        self.refresh_files(parent_dir, on_loaded=lambda: self.select_in_tree(target_name))
+
+    def path_index(self, host=None):
+        # Known-path index for a host, loaded from disk on first use
+        host = host or self.cache_host()
+        with self.path_index_lock:
+            index = self.path_indexes.get(host)
+            if index is None:
+                index = PathIndex(self.cache_file(host, ".paths.gz"))
+                index.load()
+                self.path_indexes[host] = index
+        return index
+
+    def cache_file(self, host, suffix):
+        return os.path.join(CACHE_DIR, re.sub(r"[^\w.-]", "_", host) + suffix)
+
+    def read_cache_file(self, host, suffix):
+        try:
+            with open(self.cache_file(host, suffix), encoding="utf-8", errors="surrogateescape") as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def write_cache_file(self, host, suffix, text):
+        path = self.cache_file(host, suffix)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8", errors="surrogateescape") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def load_overview(self, host, home):
+        # Runs on a worker. fs_overview keeps its own directory/mtime cache on
+        # the host, so after the first run it only re-lists what changed.
+        try:
+            text = self.run_remote_bulk("fs_overview")
+        except Exception:
+            text = ""
+        if not text.strip() and self.use_local_mode:
+            # No zsh locally: plain find, like fs_overview's first run
+            try:
+                text = subprocess.getoutput(f"find {shlex.quote(home)} -maxdepth 10 -type d -not -path '*/.*' 2>/dev/null")
+            except Exception:
+                text = ""
+        if not text.strip():
+            return None
+        self.log_ai("System: File System Context Loaded.")
+        self.index_overview(host, text, home)
+        self.write_cache_file(host, ".overview", text)
+        return text
+
+    def refresh_overview(self):
+        # Bring a cached overview up to date without holding up the explorer
+        host, conn, home = self.cache_host(), self.conn, self.home
+
+        def work(task):
+            return self.load_overview(host, home)
+
+        def done(text):
+            if not text:
+                return
+            if conn:
+                conn.fs_context = text
+            if host == self.cache_host():
+                self.fs_context = text
+
+        self.engine.submit(work, done, key="overview")
+
+    def prompt_focus(self):
+        # Tk thread: the current and recently visited directories, and the
+        # overview token budget, for ContextBuilder.build on the AI worker
+        home = self.home
+        recent = [self.current_path] + self.history_back[::-1]
+        focus = list(dict.fromkeys(tilde_path(resolve_path(p, home), home) for p in recent if p))[:6]
+        budget = int(self.get_active_host_profile().get("context_tokens", CONTEXT_TOKEN_BUDGET))
+        return focus, budget
+
+    def index_overview(self, host, overview, home):
+        # fs_overview lists directories (home shown as ~); remember them all
+        index = self.path_index(host)
+        index.add_many((resolve_path(line, home), "d") for line in overview.splitlines()
+                       if line.startswith(("~", "/")))
         try:
-            if self.use_local_mode:
+            index.save()
+        except OSError:
+            pass
+
+    def save_path_indexes(self):
+        # Also persists the AI response cache (everything under CACHE_DIR)
+        for cache in list(self.path_indexes.values()) + [self.ai_cache]:
+            try:
+                cache.save()
+            except OSError:
+                pass
+
+    def invalidate_listing(self, path):
+        # Forget cached listings a write may have changed: the path itself
+        # (if it is a directory) and the directory that contains it
+        host = self.cache_host()
+        self.listing_cache.invalidate(host, path)
+        self.listing_cache.invalidate(host, posixpath.dirname(path.rstrip("/")) or ".")
+
+    def format_results(self, entries):
+        return "\n".join(f"{e.type}  {e.name}  {e.size if e.size is not None else '?'}" for e in entries)
+
+    def perform_copy(self, src, dest, direction, on_done=None):
+        # on_done(dest) after a successful copy, on_done(None) otherwise
+        local, home, conn = self.use_local_mode, self.home, self.conn
+        # The AI writes ~ for both homes; neither sftp nor shutil expands it
+        client_side = os.path.expanduser
+        host_side = client_side if local else (lambda p: resolve_path(p, home))
+
+        def work(task):
+            if local:
                 # Local copy using shutil (or just cp command via subprocess)
                 # Since we are local, both src and dest are local paths.
                 # "direction" is meaningless in local mode, but we'll assume it's just a copy.
                 import shutil
-                shutil.copy2(src, dest)
-                self.log_ai(f"Success: Copied {src} to {dest} (Local)")
-                self.refresh_files()
-                return
+                shutil.copy2(client_side(src), client_side(dest))
+                return f"Success: Copied {src} to {dest} (Local)", True
 
             if direction == "to_client":
-                self.sftp.get(src, dest)
-                self.log_ai(f"Success: Downloaded {src} to {dest}")
+                conn.live_sftp().get(host_side(src), client_side(dest))
+                return f"Success: Downloaded {src} to {dest}", False
             elif direction == "to_host":
-                self.sftp.put(src, dest)
+                conn.live_sftp().put(client_side(src), host_side(dest))
+                return f"Success: Uploaded {src} to {dest}", True
+            return f"Copy Failed: unknown direction {direction!r}", None
+
+        def done(outcome):
+            message, refresh = outcome
+            if refresh:
+                self.invalidate_listing(host_side(dest))
                 self.refresh_files() # Refresh view
-                self.log_ai(f"Success: Uploaded {src} to {dest}")
-        except Exception as e:
+            self.log_ai(message)
+            if on_done:
+                on_done(None if refresh is None else dest)
+
+        def failed(e):
             self.log_ai(f"Copy Failed: {e}")
+            if on_done:
+                on_done(None)
+
+        self.engine.submit(work, done, failed)
 
     # --- CONTEXT MENU ACTIONS ---
     def show_context_menu(self, event):
         # Select item under cursor
-        item = self.tree.identify_row(event.y)
-        if item:
-            self.tree.selection_set(item)
+        if self.file_view.select_at(event.y):
             self.context_menu.post(event.x_root, event.y_root)
 
     def download_selection(self):
-        item_id = self.tree.selection()
-        if not item_id: return
-        item_id = item_id[0]
-        
-        item_dict = self.tree.item(item_id)
-        tags = item_dict.get("tags", [])
+        entry = self.file_view.selected_entry()
+        if not entry: return
         
-        if not tags or len(tags) < 2: return
-        
-        ftype = tags[0]
-        filename = tags[1]
+        filename = entry.name
         full_path = os.path.join(self.current_path, filename)
         
-        if ftype == 'dir':
+        if entry.is_dir:
             messagebox.showwarning("Not Supported", "Directory download is not supported yet.\nPlease select a file.")
             return
             
         # Ask for save location
         dest_path = filedialog.asksaveasfilename(initialfile=filename, title="Save File")
         if dest_path:
-            # Run in thread to not block UI
-            threading.Thread(target=self.perform_manual_download, args=(full_path, dest_path), daemon=True).start()
+            # Run on a worker to not block UI
+            self.perform_manual_download(full_path, dest_path)
 
     def perform_manual_download(self, src, dest):
-        try:
-            self.log_ai(f"System: Starting download of {src}...")
-            if self.use_local_mode:
+        self.log_ai(f"System: Starting download of {src}...")
+        local, conn = self.use_local_mode, self.conn
+
+        def work(task):
+            if local:
                 import shutil
                 shutil.copy2(src, dest)
             else:
-                self.sftp.get(src, dest)
-            
+                conn.live_sftp().get(src, dest)
+
+        def done(_):
             self.log_ai(f"Success: Downloaded to {dest}")
-            # Use after to show messagebox in main thread
-            self.after(0, lambda: messagebox.showinfo("Download Complete", f"File saved to:\n{dest}"))
-        except Exception as e:
+            messagebox.showinfo("Download Complete", f"File saved to:\n{dest}")
+
+        def failed(e):
             self.log_ai(f"Error: {e}")
-            self.after(0, lambda: messagebox.showerror("Download Failed", str(e)))
+            messagebox.showerror("Download Failed", str(e))
+
+        self.engine.submit(work, done, failed)
 
     # --- TRAY ICON & WINDOW CONTROL ---
     def setup_tray_icon(self):
-        if not pystray:
-            return
+        # Tray icon setup (if pystray is available); built on a worker
         if self.tray_running:
             return
+        self.engine.submit(self.build_tray_icon, self.start_tray_icon,
+                           lambda e: self.log_ai(f"Warning: Tray icon failed: {e}"))
+
+    def build_tray_icon(self, task):
         try:
-            icon_size = 64
-            img = Image.new("RGBA", (icon_size, icon_size), (0, 0, 0, 0))
-            draw = ImageDraw.Draw(img)
-            # Outer circle
-            draw.ellipse((4, 4, icon_size - 4, icon_size - 4), fill=self.COLORS["accent"])
-            # Inner cross
-            draw.rectangle((icon_size//2 - 8, icon_size//2 - 14, icon_size//2 + 8, icon_size//2 + 14), fill=self.COLORS["bg"])
-            draw.rectangle((icon_size//2 - 14, icon_size//2 - 8, icon_size//2 + 14, icon_size//2 + 8), fill=self.COLORS["bg"])
-
-            menu = pystray.Menu(
-                pystray.MenuItem("Show/Hide", self.toggle_window),
-                pystray.MenuItem("New Window", self.show_window),
-                pystray.MenuItem("Quick Surf", self.quick_prompt_window),
-                pystray.MenuItem("Exit", self.tray_exit)
-            )
-            self.tray_icon = pystray.Icon("Neural SSH", img, "Neural SSH Explorer", menu)
-            self.tray_running = True
-            self.tray_thread = threading.Thread(target=self.tray_icon.run, daemon=True)
-            self.tray_thread.start()
-        except Exception as e:
-            self.log_ai(f"Warning: Tray icon failed: {e}")
+            import pystray
+        except ImportError:
+            return None
+        Image, _, ImageDraw = load_pil()
+        icon_size = 64
+        img = Image.new("RGBA", (icon_size, icon_size), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        # Outer circle
+        draw.ellipse((4, 4, icon_size - 4, icon_size - 4), fill=self.COLORS["accent"])
+        # Inner cross
+        draw.rectangle((icon_size//2 - 8, icon_size//2 - 14, icon_size//2 + 8, icon_size//2 + 14), fill=self.COLORS["bg"])
+        draw.rectangle((icon_size//2 - 14, icon_size//2 - 8, icon_size//2 + 14, icon_size//2 + 8), fill=self.COLORS["bg"])
+
+        menu = pystray.Menu(
+            pystray.MenuItem("Show/Hide", self.toggle_window),
+            pystray.MenuItem("New Window", self.show_window),
+            pystray.MenuItem("Quick Surf", self.quick_prompt_window),
+            pystray.MenuItem("Exit", self.tray_exit)
+        )
+        return pystray.Icon("Neural SSH", img, "Neural SSH Explorer", menu)
+
+    def start_tray_icon(self, icon):
+        if icon is None:
+            self.log_ai("Warning: pystray not installed; tray icon disabled.")
+            return
+        self.tray_icon = icon
+        self.tray_running = True
+        self.tray_thread = threading.Thread(target=self.tray_icon.run, daemon=True)
+        self.tray_thread.start()
 
     def toggle_window(self, *args):
         self.after(0, lambda: (self.show_window() if self.state() == 'withdrawn' else self.hide_to_tray()))
@@ -1017,9 +4495,10 @@ class RemoteExplorer(tk.Tk):
 
     def on_close(self):
         # Instead of closing, hide to tray if available
-        if pystray:
+        if self.tray_running:
             self.hide_to_tray()
         else:
+            self.save_path_indexes()
             self.destroy()
 
     def quick_prompt_window(self, *args):
@@ -1062,6 +4541,8 @@ class RemoteExplorer(tk.Tk):
             except:
                 pass
             self.tray_running = False
+            self.save_path_indexes()
+            self.pool.close_all()
             self.destroy()
         self.after(0, _exit)
 
@@ -0,0 +1,39 @@
+import pytest
+
+from client import local_intent
+
+SUBDIRS = ["src", "Docs"]
+OVERVIEW = {"projects": ["~/work/projects"], "logs": ["/var/log", "~/logs"]}
+
+
+def dirs_named(name):
+    return OVERVIEW.get(name, [])
+
+
+def nav(path):
+    return {"action": "navigate", "params": {"path": path}}
+
+
+@pytest.mark.parametrize("command, expected", [
+    ("cd ..", {"action": "up", "params": {}}),
+    ("cd ..!", {"action": "up", "params": {}}),
+    ("go up.", {"action": "up", "params": {}}),
+    ("back", {"action": "up", "params": {}}),
+    ("Please go forward!", {"action": "forward", "params": {}}),
+    ("cd", nav("~")),
+    ("go home.", nav("~")),
+    ("cd ~/", nav("~")),
+    ("cd /etc/nginx", nav("/etc/nginx")),
+    ("go to ~/Desktop.", nav("~/Desktop")),
+    ("open src", nav("/home/u/src")),
+    ("open the docs folder", nav("/home/u/Docs")),
+    ("take me to projects.", nav("~/work/projects")),
+    ("go to logs", None),  # two overview matches: ask the AI
+    ("open nowhere", None),
+    ("find invoice.pdf.", {"action": "search", "params": {"query": "invoice.pdf"}}),
+    ('search for "tax report"', {"action": "search", "params": {"query": "tax report"}}),
+    ("grep 8443 in ~/etc", {"action": "grep", "params": {"pattern": "8443", "path": "~/etc"}}),
+    ("copy the report to my desktop", None),
+])
+def test_local_intent(command, expected):
+    assert local_intent(command, "/home/u", SUBDIRS, dirs_named) == expected